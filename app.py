@@ -1,23 +1,38 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Request, Response, render_template, request, jsonify, redirect, url_for, flash, g, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, update
 from flask_migrate import Migrate
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import openai
+import httpx
 from dotenv import load_dotenv
-from pinecone.grpc import PineconeGRPC as Pinecone
-from pinecone import ServerlessSpec
 import logging
-from PyPDF2 import PdfReader
 from openai import OpenAI
+import click
 import time
 import boto3
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
 import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from werkzeug.utils import secure_filename
 import tempfile
-import textwrap
-import PyPDF2
+import uuid
+import hashlib
+import itertools
+import json
+from array import array
+from collections import OrderedDict
+import numpy as np
+from chunking import SENTENCE_END, TOKENS_ESTIMATED, chunk_pages, count_tokens
+from extraction import DOCUMENT_EXTENSIONS, HEADING_EXTENSIONS, document_extension, extract_pages
+from metrics import TimedProxy, call_timed, record_stage, render_metrics, request_seconds, server_timing_header, timed
+from retrieval import BM25Index, RetrievedChunk, reciprocal_rank_fusion, rerank
+from singleflight import LEADER, SHARED, SingleFlight
+from upstream import BULK, INTERACTIVE, AdaptiveRateLimiter, ConcurrencyLimit, UpstreamBusyError
+from vector_store import LocalVectorStore, PineconeVectorStore
 
 # Initialize extensions first, before creating the app
 db = SQLAlchemy()
@@ -30,15 +45,11 @@ load_dotenv()
 
 # Access the API keys
 openai.api_key = os.getenv('OPENAI_API_KEY')
-pinecone_api_key = os.getenv('PINECONE_API_KEY')
 
-# Check if the Pinecone API key is loaded
-if not pinecone_api_key:
-    raise ValueError("Pinecone API key is not set. Please check your .env file.")
-
-# Add these debug prints
-print("Initializing Pinecone...")
-print(f"Pinecone API Key exists: {bool(pinecone_api_key)}")
+# 'pinecone', or 'local' for the in-process index in vector_store.py
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'pinecone').lower()
+LOCAL_VECTOR_STORE_PATH = os.getenv('LOCAL_VECTOR_STORE_PATH', 'vector_store_data')
+EMBEDDING_DIMENSION = 1536
 
 # Add these debug prints at the start of your app
 import logging
@@ -48,59 +59,187 @@ logger = logging.getLogger(__name__)
 # Add these debug prints right after your imports
 logger.info("Starting application initialization...")
 
-# At the top of your file, add a flag to prevent multiple initializations
-initialization_lock = threading.Lock()
-initialization_done = False
-
 # Add this near the top of your file with other configurations
-ALLOWED_EXTENSIONS = {'pdf', 'txt', 'doc', 'docx', 'xlsx', 'xls', 'csv'}
+ALLOWED_EXTENSIONS = set(DOCUMENT_EXTENSIONS)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Replace the initialization code
-try:
-    with initialization_lock:
-        if not initialization_done:
-            logger.info("Loading environment variables...")
-            load_dotenv()
-            
-            logger.info("Checking Pinecone API key...")
-            pinecone_api_key = os.getenv('PINECONE_API_KEY')
-            if not pinecone_api_key:
-                logger.error("Pinecone API key not found in environment variables")
-                raise ValueError("Pinecone API key is not set")
-            
-            logger.info("Initializing Pinecone...")
-            pc = Pinecone(api_key=pinecone_api_key)
-            logger.info("Pinecone initialized successfully")
-            
-            logger.info("Setting up Pinecone index...")
-            index_name = os.getenv('PINECONE_INDEX_NAME')
-            
-            # Check if index exists but DON'T try to delete it
-            existing_indexes = pc.list_indexes().names()
-            if index_name not in existing_indexes:
-                logger.info(f"Creating new index: {index_name}")
-                pc.create_index(
-                    name=index_name,
-                    dimension=1536,
-                    metric='cosine',
-                    spec=ServerlessSpec(
-                        cloud='aws',
-                        region='us-east-1'
-                    )
-                )
-                logger.info("Index created successfully")
-            else:
-                logger.info(f"Using existing index: {index_name}")
-            
-            initialization_done = True
+# Shared API clients, built once per worker process and reused by every
+# request so HTTP keep-alive and gRPC connections are pooled
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+# Retries are made by the rate limiters below, not by the OpenAI client
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '4'))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+PINECONE_TIMEOUT = int(os.getenv('PINECONE_TIMEOUT', '20'))
+PINECONE_POOL_THREADS = int(os.getenv('PINECONE_POOL_THREADS', '4'))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '20'))
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', '5'))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '60'))
+
+# Calls in flight per upstream in one worker process; callers beyond the
+# limit queue for up to UPSTREAM_QUEUE_TIMEOUT seconds, then fail
+VECTOR_STORE_MAX_CONCURRENCY = int(os.getenv('VECTOR_STORE_MAX_CONCURRENCY', '16'))
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', str(S3_MAX_POOL_CONNECTIONS)))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', '30'))
+
+# OpenAI rate limits for this process, 0 for no limit of that kind. With
+# several gunicorn workers, divide the account's limits between them.
+EMBEDDING_MAX_RPM = float(os.getenv('EMBEDDING_MAX_RPM', '0'))
+EMBEDDING_MAX_TPM = float(os.getenv('EMBEDDING_MAX_TPM', '0'))
+CHAT_MAX_RPM = float(os.getenv('CHAT_MAX_RPM', '0'))
+CHAT_MAX_TPM = float(os.getenv('CHAT_MAX_TPM', '0'))
+# Starting (and highest) concurrency; halved on every burst of 429s
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '8'))
+CHAT_MAX_CONCURRENCY = int(os.getenv('CHAT_MAX_CONCURRENCY', '12'))
+
+embedding_limiter = AdaptiveRateLimiter(
+    'openai_embeddings',
+    requests_per_minute=EMBEDDING_MAX_RPM,
+    tokens_per_minute=EMBEDDING_MAX_TPM,
+    max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+    max_retries=OPENAI_MAX_RETRIES,
+    queue_timeout=UPSTREAM_QUEUE_TIMEOUT * 4,
+    retryable_exceptions=(openai.APIConnectionError,)
+)
+chat_limiter = AdaptiveRateLimiter(
+    'openai_chat',
+    requests_per_minute=CHAT_MAX_RPM,
+    tokens_per_minute=CHAT_MAX_TPM,
+    max_concurrency=CHAT_MAX_CONCURRENCY,
+    max_retries=OPENAI_MAX_RETRIES,
+    queue_timeout=UPSTREAM_QUEUE_TIMEOUT,
+    retryable_exceptions=(openai.APIConnectionError,)
+)
+vector_store_limit = ConcurrencyLimit('vector', VECTOR_STORE_MAX_CONCURRENCY, UPSTREAM_QUEUE_TIMEOUT)
+s3_limit = ConcurrencyLimit('s3', S3_MAX_CONCURRENCY, UPSTREAM_QUEUE_TIMEOUT)
+
+clients = {}
+client_build_locks = {}
+clients_pid = None
+clients_lock = threading.Lock()
+
+def get_client(name, factory):
+    """Return the named client for this process, building it on first use.
+
+    The registry is reset when the process id changes, so clients created
+    before a gunicorn fork are never shared with the children. A client is
+    built under a lock of its own, so a slow build, such as the Pinecone
+    index check, only holds up callers of that client.
+    """
+    global clients_pid
+    with clients_lock:
+        if clients_pid != os.getpid():
+            clients.clear()
+            client_build_locks.clear()
+            clients_pid = os.getpid()
+        if name in clients:
+            return clients[name]
+        build_lock = client_build_locks.setdefault(name, threading.Lock())
+
+    with build_lock:
+        with clients_lock:
+            if name in clients:
+                return clients[name]
+        client = factory()
+        with clients_lock:
+            clients[name] = client
+        return client
+
+def get_openai_client():
+    return get_client('openai', lambda: OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        timeout=OPENAI_TIMEOUT,
+        max_retries=0,
+        http_client=openai.DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+            )
+        )
+    ))
+
+def get_pinecone_client():
+    def build():
+        # Imported here so workers using the local vector store never load gRPC
+        from pinecone.grpc import PineconeGRPC as Pinecone
 
-except Exception as e:
-    logger.error(f"Error during initialization: {str(e)}")
-    raise
+        if not os.getenv('PINECONE_API_KEY'):
+            raise ValueError("Pinecone API key is not set. Please check your .env file.")
+        logger.info("Initializing Pinecone...")
+        return Pinecone(
+            api_key=os.getenv('PINECONE_API_KEY'),
+            pool_threads=PINECONE_POOL_THREADS
+        )
+    return get_client('pinecone', build)
+
+def ensure_pinecone_index(pc):
+    """Create the configured index if it doesn't exist yet (never deletes an existing one)"""
+    from pinecone import ServerlessSpec
+
+    index_name = os.getenv('PINECONE_INDEX_NAME')
+    if index_name in pc.list_indexes().names():
+        logger.info(f"Using existing index: {index_name}")
+        return
+    logger.info(f"Creating new index: {index_name}")
+    pc.create_index(
+        name=index_name,
+        dimension=EMBEDDING_DIMENSION,
+        metric='cosine',
+        spec=ServerlessSpec(
+            cloud='aws',
+            region='us-east-1'
+        )
+    )
+    logger.info("Index created successfully")
+
+def get_pinecone_index():
+    """Return the Pinecone index, checking it exists on first use in each process.
+
+    A failed check raises to the caller and is retried on the next call, so
+    a Pinecone outage fails requests instead of the worker boot.
+    """
+    def build():
+        from pinecone.grpc import GRPCClientConfig
+
+        pc = get_pinecone_client()
+        ensure_pinecone_index(pc)
+        return pc.Index(
+            os.getenv('PINECONE_INDEX_NAME'),
+            grpc_config=GRPCClientConfig(timeout=PINECONE_TIMEOUT, reuse_channel=True)
+        )
+    return get_client('pinecone_index', build)
+
+def get_vector_store():
+    """Return the configured vector store, which all retrieval and indexing goes through"""
+    # Queries are timed by the caller, which may run them on another thread
+    timed_methods = ('upsert', 'fetch', 'delete', 'list_ids')
+    if VECTOR_STORE_BACKEND == 'local':
+        return get_client('vector_store', lambda: TimedProxy(LocalVectorStore(
+            LOCAL_VECTOR_STORE_PATH,
+            dimension=EMBEDDING_DIMENSION
+        ), 'vector', timed_methods, limit=vector_store_limit))
+    return get_client('vector_store', lambda: TimedProxy(
+        PineconeVectorStore(get_pinecone_index()), 'vector', timed_methods, limit=vector_store_limit
+    ))
+
+def get_s3_client():
+    return get_client('s3', lambda: TimedProxy(boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name='us-east-1',  # or your preferred region
+        config=BotoConfig(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=S3_CONNECT_TIMEOUT,
+            read_timeout=S3_READ_TIMEOUT,
+            retries={'max_attempts': 3, 'mode': 'standard'}
+        )
+    ), 's3', (
+        'upload_fileobj', 'upload_file', 'download_fileobj', 'download_file',
+        'delete_object', 'delete_objects', 'list_objects_v2'
+    ), limit=s3_limit))
 
 # Remove any logging of API keys
 logger.info("Initializing application...")
@@ -118,26 +257,99 @@ if database_url and database_url.startswith('postgres://'):
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'postgresql://localhost/smart'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Every request thread of a gthread worker may hold a connection at once
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_pre_ping': True
+    }
 app.config['UPLOAD_FOLDER'] = 'uploads'
 
+class SpoolingRequest(Request):
+    """Request that spools uploaded files to named temp files.
+
+    Ingestion reads that one copy for both the S3 upload and text
+    extraction, so an upload is written to disk exactly once.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        suffix = os.path.splitext(secure_filename(filename or ''))[1]
+        return tempfile.NamedTemporaryFile('wb+', prefix='upload-', suffix=suffix, delete=False)
+
+app.request_class = SpoolingRequest
+
+def claim_uploaded_file(file):
+    """Take ownership of an uploaded file's spooled copy and return its path"""
+    path = getattr(file.stream, 'name', None)
+    if not isinstance(path, str):
+        # Not spooled by SpoolingRequest, fall back to writing our own copy
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
+            file.save(temp_file)
+        return temp_file.name
+    file.stream.flush()
+    g.setdefault('claimed_uploads', set()).add(path)
+    return path
+
+# Add a Server-Timing header with per-stage durations to every response
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    request_seconds.observe(
+        elapsed,
+        request.url_rule.rule if request.url_rule else 'unmatched',
+        request.method,
+        str(response.status_code)
+    )
+    if SERVER_TIMING_ENABLED:
+        stages = server_timing_header()
+        response.headers['Server-Timing'] = f"{stages + ', ' if stages else ''}total;dur={elapsed * 1000:.1f}"
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.teardown_request
+def remove_unclaimed_uploads(exc=None):
+    # request.files is only populated if the route parsed the form
+    files = request.__dict__.get('files')
+    if not files:
+        return
+    claimed = g.get('claimed_uploads', set())
+    for file in files.values():
+        path = getattr(file.stream, 'name', None)
+        if isinstance(path, str) and path not in claimed and os.path.exists(path):
+            file.stream.close()
+            os.unlink(path)
+
 # Initialize the application with extensions
 db.init_app(app)
 migrate.init_app(app, db)
 
-with app.app_context():
-    db.create_all()  # This will create tables
-    
-
 # Database Models
-class DeGoudseSettings(db.Model):
-    __tablename__ = 'degoudse_settings'
-    
+class SectionSetting(db.Model):
+    """A page section (title and link, or rich text content) configured per tenant, e.g. an insurer or the demo page"""
+    __tablename__ = 'section_settings'
+    __table_args__ = (
+        db.UniqueConstraint('tenant', 'section_number', name='uq_section_settings_tenant_section'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    tenant = db.Column(db.String(50), nullable=False)
     section_number = db.Column(db.Integer, nullable=False)
     title = db.Column(db.String(200))
     link = db.Column(db.String(500))
-    content = db.Column(db.Text)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    content = db.Column(db.Text)  # For section 5
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
         return {
@@ -147,71 +359,188 @@ class DeGoudseSettings(db.Model):
             'content': self.content
         }
 
-class BaloiseSettings(db.Model):
-    __tablename__ = 'baloise_settings'
-    
+    def __repr__(self):
+        return f'<SectionSetting {self.tenant} {self.section_number}: {self.title}>'
+
+class EmbeddingCacheEntry(db.Model):
+    __tablename__ = 'embedding_cache'
+
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of model name and normalized text
+    model = db.Column(db.String(100), nullable=False)
+    embedding = db.Column(db.LargeBinary, nullable=False)  # packed float32 values
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class CorpusVersion(db.Model):
+    __tablename__ = 'corpus_version'
+
     id = db.Column(db.Integer, primary_key=True)
-    section_number = db.Column(db.Integer, nullable=False)
-    title = db.Column(db.String(200))
-    link = db.Column(db.String(500))
-    content = db.Column(db.Text)  # For section 5
+    version = db.Column(db.Integer, nullable=False, default=0)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class DocumentManifest(db.Model):
+    __tablename__ = 'document_manifests'
+
+    filename = db.Column(db.String(255), primary_key=True)
+    chunk_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    chunks = db.relationship('DocumentChunk', backref='manifest', cascade='all, delete-orphan',
+                             passive_deletes=True, order_by='DocumentChunk.chunk_index')
+
+class DocumentChunk(db.Model):
+    __tablename__ = 'document_chunks'
+
+    vector_id = db.Column(db.String(512), primary_key=True)
+    filename = db.Column(db.String(255), db.ForeignKey('document_manifests.filename', ondelete='CASCADE'),
+                         nullable=False, index=True)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    # Set once the vector is upserted; null while an ingestion is in flight
+    content_hash = db.Column(db.String(64))
+    text = db.Column(db.Text)  # for lexical retrieval
+
+class IngestionJob(db.Model):
+    __tablename__ = 'ingestion_jobs'
+
+    id = db.Column(db.String(36), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    stage = db.Column(db.String(50))
+    chunks_done = db.Column(db.Integer, default=0)
+    chunks_total = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
     def to_dict(self):
         return {
-            'section_number': self.section_number,
-            'title': self.title,
-            'link': self.link,
-            'content': self.content
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'chunks_done': self.chunks_done or 0,
+            'chunks_total': self.chunks_total,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-class DemoSettings(db.Model):
-    __tablename__ = 'demo_settings'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    section_number = db.Column(db.Integer, nullable=False)
-    title = db.Column(db.String(200))
-    link = db.Column(db.String(500))
-    content = db.Column(db.Text)  # For section 5
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+# Files above the threshold are sent as concurrent multipart uploads
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', '16')) * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', '8')) * 1024 * 1024
+S3_MULTIPART_CONCURRENCY = int(os.getenv('S3_MULTIPART_CONCURRENCY', '8'))
 
-    def __repr__(self):
-        return f'<DemoSettings {self.section_number}: {self.title}>'
-
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name='us-east-1'  # or your preferred region
+s3_transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_MULTIPART_CONCURRENCY,
+    use_threads=True
 )
 
 def upload_file_to_s3(file_data, filename):
     try:
         bucket_name = os.getenv('S3_BUCKET_NAME')
         logger.info(f"Uploading {filename} to S3 bucket {bucket_name}")
-        s3_client.upload_fileobj(
+        get_s3_client().upload_fileobj(
             file_data,
             bucket_name,
-            filename
+            filename,
+            Config=s3_transfer_config
         )
+        invalidate_s3_listing()
         return True
     except Exception as e:
         logger.error(f"Error uploading to S3: {str(e)}")
         return False
 
+def upload_local_file_to_s3(path, filename):
+    with open(path, 'rb') as file_data:
+        return upload_file_to_s3(file_data, filename)
+
+# The bucket listing is cached per worker until it expires, this worker changes
+# the bucket, or another worker bumps the corpus version
+S3_LISTING_CACHE_TTL = float(os.getenv('S3_LISTING_CACHE_TTL', '300'))
+# delete_objects accepts at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
+S3_DELETE_CONCURRENCY = int(os.getenv('S3_DELETE_CONCURRENCY', '8'))
+
+s3_listing_cache = {}
+s3_listing_cache_lock = threading.Lock()
+
+def iter_s3_objects(bucket_name=None, prefix=''):
+    """Lazily yield every object in the bucket, one list_objects_v2 page at a time"""
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    pages = iter(paginator.paginate(Bucket=bucket_name or os.getenv('S3_BUCKET_NAME'), Prefix=prefix))
+    while True:
+        with s3_limit:
+            page, seconds = call_timed(next, pages, None)
+        if page is None:
+            return
+        record_stage('s3_list_objects_v2', seconds)
+        yield from page.get('Contents', [])
+
+def list_s3_objects():
+    """All objects in the bucket, from the listing cache when it is still valid"""
+    corpus_version = get_corpus_version()
+    with s3_listing_cache_lock:
+        cached = s3_listing_cache.get('objects')
+        if cached and cached[0] == corpus_version and cached[1] > time.monotonic():
+            return cached[2]
+    objects = list(iter_s3_objects())
+    with s3_listing_cache_lock:
+        s3_listing_cache['objects'] = (corpus_version, time.monotonic() + S3_LISTING_CACHE_TTL, objects)
+    return objects
+
+def invalidate_s3_listing():
+    with s3_listing_cache_lock:
+        s3_listing_cache.clear()
+
+def delete_s3_objects(keys, bucket_name=None):
+    """Delete keys in delete_objects batches of 1000, several batches at a time; returns the number deleted.
+
+    keys may be any iterable, such as a lazy listing, and is consumed as the
+    deletes are sent.
+    """
+    bucket_name = bucket_name or os.getenv('S3_BUCKET_NAME')
+    s3_client = get_s3_client()
+
+    def delete_batch(batch):
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+        )
+        errors = response.get('Errors', [])
+        if errors:
+            raise RuntimeError(f"Failed to delete {len(errors)} objects, e.g. {errors[0].get('Key')}: {errors[0].get('Message')}")
+        return len(batch)
+
+    pending = []
+    deleted = 0
+    batch = []
+    try:
+        with ThreadPoolExecutor(max_workers=S3_DELETE_CONCURRENCY) as executor:
+            for key in keys:
+                batch.append(key)
+                if len(batch) == S3_DELETE_BATCH_SIZE:
+                    pending.append(executor.submit(delete_batch, batch))
+                    batch = []
+                # Bound the number of keys held in memory
+                while len(pending) > S3_DELETE_CONCURRENCY * 2:
+                    deleted += pending.pop(0).result()
+            if batch:
+                pending.append(executor.submit(delete_batch, batch))
+            for future in pending:
+                deleted += future.result()
+    finally:
+        invalidate_s3_listing()
+    return deleted
+
 def get_documents_from_s3():
     try:
-        bucket_name = os.getenv('S3_BUCKET_NAME')
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        documents = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                documents.append({
-                    'filename': obj['Key'],
-                    'upload_date': obj['LastModified'].isoformat()
-                })
-        return documents
+        return [{
+            'filename': obj['Key'],
+            'upload_date': obj['LastModified'].isoformat()
+        } for obj in list_s3_objects()]
     except Exception as e:
         logger.error(f"Error listing S3 objects: {str(e)}")
         return []
@@ -220,7 +549,7 @@ def download_from_s3(filename):
     """Download a file from S3"""
     try:
         local_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        s3_client.download_file(
+        get_s3_client().download_file(
             os.getenv('S3_BUCKET_NAME'),
             filename,
             local_path
@@ -233,153 +562,175 @@ def download_from_s3(filename):
 def delete_from_s3(filename):
     """Delete a file from S3"""
     try:
-        s3_client.delete_object(
+        get_s3_client().delete_object(
             Bucket=os.getenv('S3_BUCKET_NAME'),
             Key=filename
         )
+        invalidate_s3_listing()
         return True
     except ClientError as e:
         logger.error(f"Error deleting from S3: {str(e)}")
         return False
 
-# Routes for saving settings
+# Tenants with section settings; adding an insurer only needs its name here
+# and a page template
+SETTINGS_TENANTS = [t.strip() for t in os.getenv('SETTINGS_TENANTS', 'degoudse,baloise,demo').split(',') if t.strip()]
+SETTINGS_SECTION_COUNT = 5
+
+# Section settings are cached per worker. Saving invalidates this worker's
+# copy; other workers pick the change up within the TTL
+SETTINGS_CACHE_TTL = float(os.getenv('SETTINGS_CACHE_TTL', '60'))
+
+settings_cache = {}
+settings_cache_lock = threading.Lock()
+
+def get_section_settings(tenant):
+    """A tenant's sections as (sections, last_modified, etag), read through the settings cache"""
+    with settings_cache_lock:
+        cached = settings_cache.get(tenant)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+    settings = {s.section_number: s for s in SectionSetting.query.filter_by(tenant=tenant)}
+    sections = []
+    for i in range(1, SETTINGS_SECTION_COUNT + 1):
+        setting = settings.get(i)
+        sections.append(setting.to_dict() if setting else {
+            'section_number': i,
+            'title': '',
+            'link': '',
+            'content': ''
+        })
+    updated = [s.updated_at for s in settings.values() if s.updated_at]
+    etag = hashlib.sha256(json.dumps(sections, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+    entry = (sections, max(updated) if updated else None, etag)
+
+    with settings_cache_lock:
+        settings_cache[tenant] = (time.monotonic() + SETTINGS_CACHE_TTL, entry)
+    return entry
+
+def invalidate_section_settings(tenant):
+    with settings_cache_lock:
+        settings_cache.pop(tenant, None)
+
+def section_settings_response(tenant):
+    """JSON response for a tenant's sections that answers 304 when the browser's copy is current"""
+    sections, last_modified, etag = get_section_settings(tenant)
+    response = jsonify(sections)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Let browsers keep a copy but revalidate it on every use
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def save_section_settings(tenant, sections):
+    """Insert or update a tenant's sections in a single INSERT ... ON CONFLICT statement"""
+    now = datetime.utcnow()
+    rows = {}
+    for section in sections:
+        section_number = int(section.get('section_number') or 0)
+        if section_number < 1:
+            raise ValueError("Missing section_number")
+        # A statement may only touch each row once, so the last entry for a section wins
+        rows[section_number] = {
+            'tenant': tenant,
+            'section_number': section_number,
+            'title': section.get('title'),
+            'link': section.get('link'),
+            'content': section.get('content'),
+            'updated_at': now
+        }
+    if not rows:
+        return 0
+
+    statement = dialect_insert(SectionSetting).values(list(rows.values()))
+    statement = statement.on_conflict_do_update(
+        index_elements=['tenant', 'section_number'],
+        set_={column: statement.excluded[column] for column in ('title', 'link', 'content', 'updated_at')}
+    )
+    db.session.execute(statement)
+    db.session.commit()
+    invalidate_section_settings(tenant)
+    return len(rows)
+
+@app.route('/settings/<tenant>', methods=['GET'])
+def get_tenant_settings(tenant):
+    if tenant not in SETTINGS_TENANTS:
+        return jsonify({'status': 'error', 'message': f'Unknown tenant: {tenant}'}), 404
+    try:
+        return section_settings_response(tenant)
+    except Exception as e:
+        logger.error(f"Error getting {tenant} settings: {str(e)}")
+        return jsonify([])
+
+@app.route('/settings/<tenant>', methods=['POST'])
+def save_tenant_settings(tenant):
+    """Save any number of a tenant's sections in one transaction: {"sections": [{"section_number": 1, ...}, ...]}"""
+    if tenant not in SETTINGS_TENANTS:
+        return jsonify({'status': 'error', 'message': f'Unknown tenant: {tenant}'}), 404
+    try:
+        data = request.json
+        sections = data.get('sections') if isinstance(data, dict) else data
+        if not sections:
+            return jsonify({'status': 'error', 'message': 'No data received'}), 400
+        saved = save_section_settings(tenant, sections)
+        logger.info(f"Saved {saved} {tenant} sections")
+        return jsonify({'status': 'success', 'saved': saved})
+    except (ValueError, TypeError, AttributeError) as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error saving {tenant} settings: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# Routes used by the admin page and the insurer pages
 @app.route('/save_degoudse_settings', methods=['POST'])
 def save_degoudse_settings():
     try:
         data = request.json
-        print("Received data:", data)  # Debug print
-        
         if not data:
             return jsonify({'status': 'error', 'message': 'No data received'})
 
         section = int(data.get('section'))
-        print(f"Processing section {section}")  # Debug print
-
-        # Find or create setting
-        setting = DeGoudseSettings.query.filter_by(section_number=section).first()
-        if not setting:
-            setting = DeGoudseSettings(section_number=section)
-            db.session.add(setting)
-            print(f"Created new setting for section {section}")  # Debug print
-        
-        # Update the fields
-        if section == 5:
-            setting.content = data.get('content', '')
-            print(f"Updated content for section 5: {setting.content[:100]}...")  # Debug print
-        else:
-            setting.title = data.get('title', '')
-            setting.link = data.get('link', '')
-            print(f"Updated section {section} - Title: {setting.title}, Link: {setting.link}")  # Debug print
-        
-        db.session.commit()
-        print(f"Successfully saved section {section}")  # Debug print
-        
+        save_section_settings('degoudse', [{**data, 'section_number': section}])
+        logger.info(f"Saved De Goudse section {section}")
         return jsonify({'status': 'success'})
     except Exception as e:
-        print("Error saving settings:", str(e))
+        logger.error(f"Error saving De Goudse settings: {str(e)}")
         db.session.rollback()
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/get_degoudse_settings')
 def get_degoudse_settings():
-    try:
-        settings = DeGoudseSettings.query.order_by(DeGoudseSettings.section_number).all()
-        print("Retrieved settings:", [s.to_dict() for s in settings])  # Debug print
-        
-        # Ensure we have 5 sections
-        result = []
-        for i in range(1, 6):
-            setting = next((s for s in settings if s.section_number == i), None)
-            if setting:
-                result.append(setting.to_dict())
-            else:
-                result.append({
-                    'section_number': i,
-                    'title': '',
-                    'link': '',
-                    'content': ''
-                })
-        
-        print("Sending result:", result)  # Debug print
-        return jsonify(result)
-    except Exception as e:
-        print("Error getting settings:", str(e))
-        return jsonify([])
+    return get_tenant_settings('degoudse')
 
 @app.route('/save_baloise_settings', methods=['POST'])
 def save_baloise_settings():
     try:
         data = request.json
-        print("Received Baloise data:", data)  # Debug print
-        
         section_number = data.get('section_number')
         if not section_number:
             raise ValueError("Missing section_number")
 
-        # Find or create setting
-        setting = BaloiseSettings.query.filter_by(section_number=section_number).first()
-        if not setting:
-            setting = BaloiseSettings(section_number=section_number)
-            db.session.add(setting)
-            print(f"Created new Baloise setting for section {section_number}")
-
-        # Update fields based on section type
-        if section_number == 5:
-            setting.content = data.get('content', '')
-            setting.title = None
-            setting.link = None
-            print(f"Updated Baloise section 5 content: {setting.content[:100]}...")
-        else:
-            setting.title = data.get('title', '')
-            setting.link = data.get('link', '')
-            setting.content = None
-            print(f"Updated Baloise section {section_number} - Title: {setting.title}, Link: {setting.link}")
-
-        setting.updated_at = datetime.utcnow()
-        db.session.commit()
-        print(f"Successfully saved Baloise section {section_number}")
-
+        save_section_settings('baloise', [data])
+        logger.info(f"Saved Baloise section {section_number}")
         return jsonify({"status": "success"})
     except Exception as e:
-        print(f"Error saving Baloise settings: {str(e)}")
+        logger.error(f"Error saving Baloise settings: {str(e)}")
         db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/get_baloise_settings')
 def get_baloise_settings():
-    try:
-        settings = BaloiseSettings.query.order_by(BaloiseSettings.section_number).all()
-        result = []
-        
-        # Ensure we have 5 sections, even if some are empty
-        for i in range(1, 6):
-            setting = next((s for s in settings if s.section_number == i), None)
-            if setting:
-                result.append({
-                    'section_number': i,
-                    'title': setting.title,
-                    'link': setting.link,
-                    'content': setting.content
-                })
-            else:
-                result.append({
-                    'section_number': i,
-                    'title': '',
-                    'link': '',
-                    'content': ''
-                })
-        
-        print("Sending Baloise settings:", result)  # Debug log
-        return jsonify(result)
-    except Exception as e:
-        print("Error getting Baloise settings:", str(e))
-        return jsonify([])
+    return get_tenant_settings('baloise')
 
 # Page routes
 @app.route('/')
 def measure():
     # Get all demo settings ordered by section number
-    demo_settings = DemoSettings.query.order_by(DemoSettings.section_number).all()
+    demo_settings = SectionSetting.query.filter_by(tenant='demo').order_by(SectionSetting.section_number).all()
     return render_template('measure.html', 
                          current_page='measure',
                          demo_settings=demo_settings)
@@ -390,7 +741,7 @@ def admin():
 
 @app.route('/manage')
 def manage():
-    demo_settings = DemoSettings.query.order_by(DemoSettings.section_number).all()
+    demo_settings = SectionSetting.query.filter_by(tenant='demo').order_by(SectionSetting.section_number).all()
     return render_template('manage.html', 
                          current_page='manage',
                          demo_settings=demo_settings,
@@ -400,9 +751,8 @@ def manage():
 @app.route('/degoudse')
 def degoudse():
     try:
-        settings = DeGoudseSettings.query.order_by(DeGoudseSettings.section_number).all()
-        print("Rendering De Goudse page with settings:", [s.to_dict() for s in settings])
-        return render_template('degoudse.html')
+        sections, _, _ = get_section_settings('degoudse')
+        return render_template('degoudse.html', section_settings=sections)
     except Exception as e:
         print("Error in degoudse route:", str(e))
         return render_template('degoudse.html')
@@ -410,9 +760,8 @@ def degoudse():
 @app.route('/baloise')
 def baloise():
     try:
-        settings = BaloiseSettings.query.order_by(BaloiseSettings.section_number).all()
-        print("Rendering Baloise page with settings:", [s.to_dict() for s in settings])
-        return render_template('baloise.html')
+        sections, _, _ = get_section_settings('baloise')
+        return render_template('baloise.html', section_settings=sections)
     except Exception as e:
         print("Error in baloise route:", str(e))
         return render_template('baloise.html')
@@ -435,143 +784,255 @@ def upload_file():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            logger.info(f"Processing file: {filename}")
-            
-            # Upload to S3
-            logger.info(f"Starting S3 upload for {filename}")
-            if not upload_file_to_s3(file, filename):
-                logger.error("Failed to upload to S3")
-                return jsonify({'success': False, 'message': 'Failed to upload to S3'})
-            
-            logger.info("S3 upload successful")
-            
-            # Process for Pinecone
-            logger.info("Starting Pinecone processing")
+            logger.info(f"Queueing file: {filename}")
+
+            if not reserve_ingestion_slot():
+                logger.error("Ingestion queue is full")
+                return jsonify({'success': False, 'message': 'Too many uploads in progress, please try again shortly'}), 503
+
             try:
-                # Get the file from S3
-                s3_client = boto3.client('s3')
-                bucket_name = os.getenv('S3_BUCKET_NAME')
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                    logger.info(f"Downloading from S3: {filename}")
-                    s3_client.download_fileobj(bucket_name, filename, temp_file)
-                    temp_file.seek(0)
-                    
-                    logger.info("Creating PDF reader")
-                    pdf_reader = PyPDF2.PdfReader(temp_file.name)
-                    text_chunks = []
-                    
-                    logger.info("Extracting text from PDF")
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        text = page.extract_text()
-                        chunks = textwrap.wrap(text, 1000)
-                        text_chunks.extend(chunks)
-                        logger.info(f"Processed page {page_num + 1}, got {len(chunks)} chunks")
-                    
-                    logger.info(f"Total chunks to process: {len(text_chunks)}")
-                    
-                    # Initialize Pinecone
-                    logger.info("Initializing Pinecone")
-                    pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-                    index = pc.Index(os.getenv('PINECONE_INDEX_NAME'))
-                    
-                    # Create embeddings and upload to Pinecone
-                    for i, chunk in enumerate(text_chunks):
-                        logger.info(f"Processing chunk {i + 1}/{len(text_chunks)}")
-                        embedding = get_embedding(chunk)
-                        
-                        # Upload to Pinecone
-                        index.upsert(
-                            vectors=[{
-                                'id': f"{filename}-chunk-{i}",
-                                'values': embedding,
-                                'metadata': {
-                                    'text': chunk,
-                                    'filename': filename
-                                }
-                            }]
-                        )
-                        logger.info(f"Uploaded chunk {i + 1} to Pinecone")
-                    
-                    os.unlink(temp_file.name)
-                    logger.info("File processing completed successfully")
-                    return jsonify({'success': True, 'message': 'File uploaded and processed successfully'})
-                    
-            except Exception as e:
-                logger.error(f"Error processing file for Pinecone: {str(e)}")
-                return jsonify({'success': False, 'message': f'Failed to process file: {str(e)}'})
+                # The spooled upload outlives the request and is removed by the job
+                local_path = claim_uploaded_file(file)
+
+                job = IngestionJob(id=str(uuid.uuid4()), filename=filename, status='queued', stage='queued')
+                db.session.add(job)
+                db.session.commit()
+
+                submit_ingestion_job(job.id, filename, local_path)
+            except Exception:
+                release_ingestion_slot()
+                raise
+
+            logger.info(f"Queued ingestion job {job.id} for {filename}")
+            return jsonify({
+                'success': True,
+                'message': 'File queued for processing',
+                'job_id': job.id
+            }), 202
+
+        return jsonify({
+            'success': False,
+            'message': f"File type not allowed, upload one of: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
+        })
                 
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    fail_stale_jobs()
+    job = db.session.get(IngestionJob, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+# Background ingestion
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '2'))
+INGESTION_MAX_PENDING = int(os.getenv('INGESTION_MAX_PENDING', '10'))
+# Processes refresh updated_at on the jobs they hold; a job not refreshed for
+# INGESTION_JOB_STALE_SECONDS belonged to a worker that exited mid-job
+INGESTION_HEARTBEAT_SECONDS = float(os.getenv('INGESTION_HEARTBEAT_SECONDS', '30'))
+INGESTION_JOB_STALE_SECONDS = float(os.getenv('INGESTION_JOB_STALE_SECONDS', '300'))
+
+ingestion_executor = None
+ingestion_executor_pid = None
+ingestion_executor_lock = threading.Lock()
+ingestion_slots = threading.BoundedSemaphore(INGESTION_MAX_PENDING)
+active_job_ids = set()
+active_job_ids_lock = threading.Lock()
+
+def get_ingestion_executor():
+    """Return this process's ingestion worker pool, creating it after a fork if needed"""
+    global ingestion_executor, ingestion_executor_pid
+    with ingestion_executor_lock:
+        if ingestion_executor is None or ingestion_executor_pid != os.getpid():
+            ingestion_executor = ThreadPoolExecutor(
+                max_workers=INGESTION_WORKERS,
+                thread_name_prefix='ingestion'
+            )
+            ingestion_executor_pid = os.getpid()
+            threading.Thread(target=run_job_heartbeat, name='ingestion-heartbeat', daemon=True).start()
+        return ingestion_executor
+
+def submit_ingestion_job(job_id, filename, local_path):
+    """Queue a job on this process's pool and keep its heartbeat going until it finishes"""
+    with active_job_ids_lock:
+        active_job_ids.add(job_id)
+    try:
+        get_ingestion_executor().submit(run_ingestion_job, job_id, filename, local_path)
+    except Exception:
+        with active_job_ids_lock:
+            active_job_ids.discard(job_id)
+        raise
+
+def run_job_heartbeat():
+    """Refresh updated_at on the jobs this process has queued or running"""
+    while True:
+        time.sleep(INGESTION_HEARTBEAT_SECONDS)
+        with active_job_ids_lock:
+            job_ids = list(active_job_ids)
+        if not job_ids:
+            continue
+        with app.app_context():
+            try:
+                IngestionJob.query.filter(IngestionJob.id.in_(job_ids)).update(
+                    {'updated_at': datetime.utcnow()}, synchronize_session=False
+                )
+                db.session.commit()
+            except Exception as e:
+                logger.warning(f"Failed to refresh ingestion job heartbeat: {str(e)}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+def fail_stale_jobs():
+    """Mark queued or running jobs whose worker stopped refreshing them as failed"""
+    cutoff = datetime.utcnow() - timedelta(seconds=INGESTION_JOB_STALE_SECONDS)
+    stale = IngestionJob.query.filter(
+        IngestionJob.status.in_(('queued', 'running')),
+        IngestionJob.updated_at < cutoff
+    ).update({
+        'status': 'failed',
+        'error': 'Processing stopped unexpectedly, the worker handling it exited. Please upload the file again.',
+        'updated_at': datetime.utcnow()
+    }, synchronize_session=False)
+    if stale:
+        logger.warning(f"Marked {stale} stale ingestion jobs as failed")
+    db.session.commit()
+
+def reserve_ingestion_slot():
+    """Claim one of the queued-or-running job slots, False when the queue is full"""
+    return ingestion_slots.acquire(blocking=False)
+
+def release_ingestion_slot():
+    ingestion_slots.release()
+
+def update_job(job_id, **fields):
+    job = db.session.get(IngestionJob, job_id)
+    if not job:
+        return
+    for key, value in fields.items():
+        setattr(job, key, value)
+    db.session.commit()
+
+def run_ingestion_job(job_id, filename, local_path):
+    """Upload a spooled file to S3, extract its text and index it, recording progress on the job row"""
+    with app.app_context():
+        try:
+            update_job(job_id, status='running', stage='extracting')
+
+            # Upload to S3 while the text is extracted from the same spooled file
+            logger.info(f"Starting S3 upload for {filename}")
+            with ThreadPoolExecutor(max_workers=1) as uploader:
+                upload_future = uploader.submit(upload_local_file_to_s3, local_path, filename)
+
+                logger.info(f"Extracting text from {filename}")
+                text_chunks = extract_document_chunks(local_path, filename)
+                # The first batch (a whole PDF, which is extracted up front) is
+                # read while the upload runs; the rest as it is indexed
+                first_batch = list(itertools.islice(text_chunks, INDEX_BATCH_SIZE))
+
+                # Don't index documents that never made it to S3
+                update_job(job_id, stage='uploading')
+                if not upload_future.result():
+                    raise RuntimeError('Failed to upload to S3')
+            logger.info("S3 upload successful")
+
+            update_job(job_id, stage='embedding')
+
+            index = get_vector_store()
+
+            # Create embeddings and upload to Pinecone in batches; the total
+            # grows as the rest of the document is read
+            stats = index_document(
+                filename,
+                itertools.chain(first_batch, text_chunks),
+                index,
+                progress=lambda done, total: update_job(job_id, chunks_done=done, chunks_total=total)
+            )
+
+            bump_corpus_version()
+            update_job(job_id, status='completed', stage='completed')
+            logger.info(f"File processing completed successfully: {stats}")
+        except Exception as e:
+            logger.error(f"Error processing file for Pinecone: {str(e)}")
+            db.session.rollback()
+            # Some chunks may already be indexed
+            bump_corpus_version()
+            update_job(job_id, status='failed', error=f'Failed to process file: {str(e)}')
+        finally:
+            if os.path.exists(local_path):
+                os.unlink(local_path)
+            db.session.remove()
+            with active_job_ids_lock:
+                active_job_ids.discard(job_id)
+            release_ingestion_slot()
+
+def extract_document_chunks(path, filename=None, counts=None):
+    """Lazily extract a document's text and chunk it, yielding Chunk objects.
+
+    The format comes from filename's extension, or path's without one. PDFs
+    are extracted in full when the first chunk is taken; other formats are
+    read as chunks are taken, so they are never held in memory whole.
+    counts, if given, is filled with the 'pages', 'chunks' and 'tokens' read
+    so far. Raises ValueError at the end when no text came out, so the
+    document isn't reported as ingested.
+    """
+    name = filename or os.path.basename(path)
+    detect_headings = document_extension(name) in HEADING_EXTENSIONS
+    counts = {} if counts is None else counts
+    counts.update(pages=0, chunks=0, tokens=0)
+    streamed_seconds = 0.0
+    chunk_seconds = 0.0
+
+    def timed_pages(pages):
+        nonlocal streamed_seconds
+        while True:
+            page, seconds = call_timed(next, pages, None)
+            streamed_seconds += seconds
+            if page is None:
+                return
+            counts['pages'] += 1
+            yield page
+
+    pages, opened_seconds = call_timed(extract_pages, path, filename)
+    chunks = chunk_pages(timed_pages(iter(pages)), detect_headings=detect_headings)
+    try:
+        while True:
+            chunk, seconds = call_timed(next, chunks, None)
+            chunk_seconds += seconds
+            if chunk is None:
+                break
+            counts['chunks'] += 1
+            counts['tokens'] += chunk.tokens
+            yield chunk
+    finally:
+        record_stage('extract', opened_seconds + streamed_seconds)
+        record_stage('chunk', chunk_seconds - streamed_seconds)
+    logger.info(f"Created {counts['chunks']} chunks from {counts['pages']} pages")
+    if not counts['chunks']:
+        raise ValueError(f'No text could be extracted from {name}')
+
+def ingest_document(filename, path, progress=None):
+    """Extract, chunk and index a local copy of a document. Shared by process_file and the ingest command"""
+    counts = {}
+    chunks = extract_document_chunks(path, filename, counts)
+    stats = index_document(filename, chunks, get_vector_store(), progress=progress)
+    stats['pages'] = counts['pages']
+    stats['tokens'] = counts['tokens']
+    stats['tokens_estimated'] = TOKENS_ESTIMATED
+    return stats
+
 def process_file(filename):
     try:
         logger.info(f"Processing file: {filename}")
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Read the PDF file
-        with open(file_path, 'rb') as file:
-            pdf = PdfReader(file)
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text()
-        
-        logger.info(f"Extracted text length: {len(text)}")
-        
-        # Split text into smaller chunks
-        chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-        logger.info(f"Created {len(chunks)} chunks")
-        
-        # Initialize Pinecone
-        pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-        
-        # Create or get index
-        index_name = os.getenv('PINECONE_INDEX_NAME')  # Use environment variable
-        try:
-            index = pc.Index(index_name)
-            logger.info("Using existing index")
-        except Exception:
-            logger.info(f"Creating new index: {index_name}")
-            pc.create_index(
-                name=index_name,
-                dimension=1536,
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud='aws',
-                    region='us-east-1'
-                )
-            )
-            time.sleep(5)  # Wait for index to be ready
-            index = pc.Index(index_name)
-        
-        # Get embeddings using OpenAI
-        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        records = []
-        
-        for i, chunk in enumerate(chunks):
-            logger.info(f"Processing chunk {i+1}/{len(chunks)}")
-            response = client.embeddings.create(
-                input=chunk,
-                model="text-embedding-ada-002"
-            )
-            embedding = response.data[0].embedding
-            
-            records.append({
-                "id": f"{filename}-chunk-{i}",
-                "values": embedding,
-                "metadata": {"text": chunk, "source": filename}
-            })
-        
-        # Upsert in batches of 100
-        batch_size = 100
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i + batch_size]
-            logger.info(f"Upserting batch {i//batch_size + 1}")
-            index.upsert(
-                vectors=batch
-            )
-        
+
+        # Extract, chunk, embed and upsert
+        ingest_document(filename, file_path)
+
         logger.info("File processing complete")
         return True
         
@@ -596,46 +1057,49 @@ def chat():
 
         logger.info(f"Received user message: {user_message}")
 
-        # Initialize OpenAI client
-        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        logger.info("OpenAI client initialized")
-        
-        # Get embedding for the user's question
-        logger.info("Getting embedding for user question...")
-        embedding_response = client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=user_message
-        )
-        question_embedding = embedding_response.data[0].embedding
-        logger.info("Embedding created successfully")
-
-        # Query Pinecone
-        logger.info("Initializing Pinecone...")
-        pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-        index = pc.Index(os.getenv('PINECONE_INDEX_NAME'))
-        
-        # Search for relevant context
-        logger.info("Querying Pinecone index...")
-        query_response = index.query(
-            vector=question_embedding,
-            top_k=3,
-            include_metadata=True
-        )
-        logger.info(f"Pinecone query response: {query_response}")
+        corpus_version = get_corpus_version()
+        question_key = normalize_question(user_message)
+        cached = get_cached_answer(question_key, corpus_version)
+        if cached:
+            logger.info("Answered from exact-match chat cache")
+            return jsonify(with_cache_status(cached, 'exact'))
+
+        def compute():
+            # Get embedding for the user's question
+            logger.info("Getting embedding for user question...")
+            question_embedding = get_embedding(user_message)
+            logger.info("Embedding created successfully")
+
+            if CHAT_SEMANTIC_CACHE_ENABLED:
+                cached = find_similar_answer(question_embedding, corpus_version)
+                if cached:
+                    logger.info("Answered from semantic chat cache")
+                    return with_cache_status(cached, 'semantic')
+
+            result = answer_question(user_message, question_embedding)
+            cache_answer(question_key, question_embedding, result, corpus_version)
+            return with_cache_status(result, 'miss')
+
+        if not CHAT_COALESCING_ENABLED:
+            return jsonify(compute())
+
+        # Identical questions asked at the same time share one answer
+        result, outcome = chat_flights.do(f'{corpus_version}:{question_key}', compute)
+        if outcome == SHARED:
+            cache_answer(question_key, None, result, corpus_version)
+        if outcome != LEADER:
+            logger.info(f"Answer shared with a concurrent identical question ({outcome})")
+            result = with_cache_status(result, outcome)
+        return jsonify(result)
 
-        # Extract relevant context from the matches
-        contexts = []
-        for match in query_response.matches:
-            if hasattr(match, 'score') and match.score > 0.7:
-                if hasattr(match, 'metadata') and 'text' in match.metadata:
-                    contexts.append(match.metadata['text'])
+    except UpstreamBusyError as e:
+        logger.warning(f"Chat request shed: {str(e)}")
+        return jsonify({'error': 'The assistant is busy, please try again shortly'}), 503
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-        # Prepare the context string
-        context_text = "\n".join(contexts) if contexts else ""
-        
-        # Prepare the messages for GPT with structured format
-        messages = [
-            {"role": "system", "content": """You are a helpful assistant. Structure your responses clearly. Keep this html structure, but only use unordered lists in the key points, convert OL in UL.
+CHAT_SYSTEM_PROMPT = """You are a helpful assistant. Structure your responses clearly. Keep this html structure, but only use unordered lists in the key points, convert OL in UL.
             
             <div>
                 <h2>Summary</h2>
@@ -659,43 +1123,445 @@ def chat():
                     <li>Reference relevant documents or sections if available</li>
                 </ul>
             </div>
-            """}
-        ]
+            """
+
+# Hybrid retrieval: vector and BM25 candidates are fetched concurrently, fused
+# with reciprocal rank fusion and reranked locally. A candidate needs either
+# the vector score or the share of question terms it covers to pass its minimum
+HYBRID_RETRIEVAL_ENABLED = os.getenv('HYBRID_RETRIEVAL', 'true').lower() == 'true'
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '5'))
+RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', '20'))
+RETRIEVAL_MIN_VECTOR_SCORE = float(os.getenv('RETRIEVAL_MIN_VECTOR_SCORE', '0.7'))
+RETRIEVAL_MIN_LEXICAL_COVERAGE = float(os.getenv('RETRIEVAL_MIN_LEXICAL_COVERAGE', '0.5'))
+
+lexical_index = {'version': None, 'index': None}
+lexical_index_lock = threading.Lock()
+
+def get_retrieval_executor():
+    return get_client('retrieval_executor', lambda: ThreadPoolExecutor(max_workers=8))
+
+def get_lexical_index():
+    """BM25 index over the indexed chunk texts, rebuilt when the corpus version changes"""
+    version = get_corpus_version()
+    with lexical_index_lock:
+        if lexical_index['version'] != version:
+            started = time.perf_counter()
+            rows = db.session.query(DocumentChunk.vector_id, DocumentChunk.text, DocumentChunk.filename).filter(
+                DocumentChunk.content_hash.isnot(None),
+                DocumentChunk.text.isnot(None)
+            ).yield_per(1000)
+            index = BM25Index((vector_id, text, {'filename': filename}) for vector_id, text, filename in rows)
+            lexical_index.update(version=version, index=index)
+            logger.info(f"Built lexical index over {len(index)} chunks in {time.perf_counter() - started:.2f}s")
+            missing = DocumentChunk.query.filter(
+                DocumentChunk.content_hash.isnot(None),
+                DocumentChunk.text.is_(None)
+            ).count()
+            if missing:
+                logger.warning(
+                    f"{missing} indexed chunks have no stored text and are left out of keyword search, "
+                    f"run 'flask backfill-chunk-text' to add them"
+                )
+        return lexical_index['index']
+
+def backfill_chunk_texts(batch_size=100):
+    """Copy the texts of chunks indexed before document_chunks stored them out of the vector metadata.
+
+    Returns (filled, missing) counts; missing chunks have no vector or no
+    text metadata left and need their document ingested again.
+    """
+    index = get_vector_store()
+    filled = missing = 0
+    last_id = ''
+    while True:
+        chunks = DocumentChunk.query.filter(
+            DocumentChunk.content_hash.isnot(None),
+            DocumentChunk.text.is_(None),
+            DocumentChunk.vector_id > last_id
+        ).order_by(DocumentChunk.vector_id).limit(batch_size).all()
+        if not chunks:
+            return filled, missing
+        last_id = chunks[-1].vector_id
+        vectors = index.fetch(ids=[chunk.vector_id for chunk in chunks]).vectors
+        for chunk in chunks:
+            vector = vectors.get(chunk.vector_id)
+            text = (getattr(vector, 'metadata', None) or {}).get('text')
+            if text is None:
+                missing += 1
+            else:
+                chunk.text = text
+                filled += 1
+        db.session.commit()
 
-        if context_text:
-            prompt = f"Using this context:\n\n{context_text}\n\nPlease answer this question: {user_message}"
-            logger.info(f"Using context in prompt. Prompt length: {len(prompt)}")
-        else:
-            prompt = f"Please answer this question: {user_message}\n\nNote: If you need specific information from documents to answer this question, please let me know."
-            logger.info("No context available for this query")
-
-        messages.append({"role": "user", "content": prompt})
-
-        # Get response from GPT
-        logger.info("Sending request to GPT...")
-        chat_response = client.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
+def vector_candidates(question_embedding, top_k):
+    with vector_store_limit:
+        query_response = get_vector_store().query(
+            vector=question_embedding,
+            top_k=top_k,
+            include_metadata=True
         )
-        logger.info("Received response from GPT")
+    return [
+        RetrievedChunk(match.id, match.metadata['text'], match.metadata, vector_score=match.score)
+        for match in query_response.matches
+        if getattr(match, 'metadata', None) and 'text' in match.metadata
+    ]
+
+def retrieve_contexts(user_message, question_embedding):
+    """Return the texts of the indexed chunks relevant to the question"""
+    if not HYBRID_RETRIEVAL_ENABLED:
+        with timed('vector_query'):
+            matches = vector_candidates(question_embedding, RETRIEVAL_TOP_K)
+        return [match.text for match in matches if match.vector_score > RETRIEVAL_MIN_VECTOR_SCORE]
+
+    # The vector query runs on the pool while BM25 runs here, where the app context is
+    logger.info("Querying vector and lexical indexes...")
+    vector_future = get_retrieval_executor().submit(
+        call_timed, vector_candidates, question_embedding, RETRIEVAL_CANDIDATES
+    )
+    try:
+        with timed('lexical_query'):
+            index = get_lexical_index()
+            lexical_hits = index.search(user_message, RETRIEVAL_CANDIDATES)
+    except Exception as e:
+        logger.warning(f"Lexical retrieval failed, using vector results only: {str(e)}")
+        index = None
+        lexical_hits = []
+    vector_hits, vector_seconds = vector_future.result()
+    record_stage('vector_query', vector_seconds)
+
+    selected = rerank(
+        user_message,
+        reciprocal_rank_fusion([vector_hits, lexical_hits]),
+        index.idf if index else {},
+        index.max_idf if index else 1.0,
+        RETRIEVAL_TOP_K,
+        RETRIEVAL_MIN_VECTOR_SCORE,
+        RETRIEVAL_MIN_LEXICAL_COVERAGE
+    )
+    logger.info(
+        f"Retrieved {len(vector_hits)} vector and {len(lexical_hits)} lexical candidates, "
+        f"selected {[(chunk.id, round(chunk.rerank_score, 3)) for chunk in selected]}"
+    )
+    return [chunk.text for chunk in selected]
+
+# Token budget for retrieved context in the chat prompt. The system prompt is
+# fixed, so its size is counted once
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv('CHAT_CONTEXT_TOKEN_BUDGET', '1200'))
+CHAT_SYSTEM_PROMPT_TOKENS = count_tokens(CHAT_SYSTEM_PROMPT)
+# Contexts with less than this share of new sentences are dropped as duplicates
+CONTEXT_MIN_NEW_FRACTION = 0.2
+CHAT_MAX_COMPLETION_TOKENS = 500
+
+def chat_request_tokens(token_usage):
+    """Tokens a chat request counts against the rate limit: the prompt plus the most it may generate"""
+    return token_usage['total'] + CHAT_MAX_COMPLETION_TOKENS
+
+def pack_contexts(contexts, budget=None):
+    """Fit contexts, most relevant first, into a token budget.
+
+    Sentences already included from an earlier context (e.g. chunk overlap)
+    are removed, contexts that add little are dropped, and a context that
+    doesn't fit is skipped in favour of smaller ones after it. Only when
+    nothing fits is the most relevant context cut to the budget. Returns the
+    packed texts and a count of the contexts dropped.
+    """
+    budget = budget or CHAT_CONTEXT_TOKEN_BUDGET
+    packed = []
+    used = 0
+    seen = set()
+    dropped = 0
+    for context in contexts:
+        sentences = [s.strip() for s in SENTENCE_END.split(context) if s.strip()]
+        new_sentences = [s for s in sentences if s not in seen]
+        if not new_sentences or len(new_sentences) < CONTEXT_MIN_NEW_FRACTION * len(sentences):
+            dropped += 1
+            continue
+        text = ' '.join(new_sentences) if len(new_sentences) < len(sentences) else context
+        tokens = count_tokens(text) + 1  # joining newline
+        if used + tokens > budget:
+            if packed:
+                dropped += 1
+                continue
+            fitted = []
+            for sentence in new_sentences:
+                sentence_tokens = count_tokens(sentence) + 1
+                if used + sentence_tokens > budget:
+                    break
+                fitted.append(sentence)
+                used += sentence_tokens
+            if fitted:
+                packed.append(' '.join(fitted))
+                seen.update(fitted)
+            else:
+                dropped += 1
+            continue
+        packed.append(text)
+        seen.update(new_sentences)
+        used += tokens
+    return packed, dropped
+
+def build_chat_messages(user_message, contexts):
+    """Build the GPT messages for a question.
+
+    Returns the messages, the context string used and the prompt's token
+    counts per section.
+    """
+    # Prepare the context string
+    packed, dropped = pack_contexts(contexts)
+    context_text = "\n".join(packed)
+
+    # Prepare the messages for GPT with structured format
+    messages = [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT}
+    ]
+
+    if context_text:
+        prompt = f"Using this context:\n\n{context_text}\n\nPlease answer this question: {user_message}"
+        logger.info(f"Using context in prompt. Prompt length: {len(prompt)}")
+    else:
+        prompt = f"Please answer this question: {user_message}\n\nNote: If you need specific information from documents to answer this question, please let me know."
+        logger.info("No context available for this query")
+
+    messages.append({"role": "user", "content": prompt})
+    context_tokens = count_tokens(context_text) if context_text else 0
+    token_usage = {
+        'system': CHAT_SYSTEM_PROMPT_TOKENS,
+        'context': context_tokens,
+        'question': count_tokens(prompt) - context_tokens,
+        'context_budget': CHAT_CONTEXT_TOKEN_BUDGET,
+        'contexts_packed': len(packed),
+        'contexts_dropped': dropped,
+        'estimated': TOKENS_ESTIMATED
+    }
+    token_usage['total'] = token_usage['system'] + token_usage['context'] + token_usage['question']
+    return messages, context_text, token_usage
+
+def build_chat_result(response_text, contexts, context_text, token_usage=None):
+    return {
+        'response': response_text,
+        'context_used': bool(context_text),
+        'debug_info': {
+            'contexts_found': len(contexts),
+            'context_length': len(context_text) if context_text else 0,
+            'tokens': token_usage or {}
+        }
+    }
+
+def answer_question(user_message, question_embedding):
+    """Retrieve context for the question and ask GPT, returning the /chat response body"""
+    contexts = retrieve_contexts(user_message, question_embedding)
+    messages, context_text, token_usage = build_chat_messages(user_message, contexts)
+
+    client = get_openai_client()
+
+    # Get response from GPT
+    logger.info("Sending request to GPT...")
+    def create():
+        with timed('openai_chat'):
+            return client.chat.completions.create(
+                model="gpt-4",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=CHAT_MAX_COMPLETION_TOKENS
+            )
+    chat_response = chat_limiter.call(create, chat_request_tokens(token_usage), INTERACTIVE)
+    logger.info("Received response from GPT")
 
-        response_text = chat_response.choices[0].message.content
-        logger.info(f"Final response: {response_text[:200]}...")
+    response_text = chat_response.choices[0].message.content
+    logger.info(f"Final response: {response_text[:200]}...")
 
-        return jsonify({
-            'response': response_text,
-            'context_used': bool(contexts),
-            'debug_info': {
-                'contexts_found': len(contexts),
-                'context_length': len(context_text) if context_text else 0
-            }
-        })
+    return build_chat_result(response_text, contexts, context_text, token_usage)
 
-    except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /chat that sends the answer as server-sent events.
+
+    Events are 'meta' (retrieval info, sent before the completion starts),
+    'token' for each piece of the answer, then 'done' or 'error'. A question
+    asked while an identical one is being answered waits for that answer
+    and gets it as a single 'token' event, like a cached answer.
+    """
+    user_message = (request.json or {}).get('message', '')
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    logger.info(f"Received streaming user message: {user_message}")
+
+    def generate():
+        flight = None
+        try:
+            corpus_version = get_corpus_version()
+            question_key = normalize_question(user_message)
+            cached = get_cached_answer(question_key, corpus_version)
+            cache_status = 'exact'
+            question_embedding = None
+            if not cached and CHAT_COALESCING_ENABLED:
+                # Identical questions asked at the same time, here or on /chat, share one answer
+                flight = chat_flights.join(f'{corpus_version}:{question_key}')
+                if flight.outcome == SHARED:
+                    cache_answer(question_key, None, flight.result, corpus_version)
+                if flight.outcome != LEADER:
+                    cached, cache_status = flight.result, flight.outcome
+            if not cached:
+                question_embedding = get_embedding(user_message)
+                cached = find_similar_answer(question_embedding, corpus_version) if CHAT_SEMANTIC_CACHE_ENABLED else None
+                cache_status = 'semantic'
+                if cached and flight:
+                    flight.finish(with_cache_status(cached, cache_status))
+
+            if cached:
+                logger.info(f"Streaming answer from {cache_status} chat cache")
+                cached = with_cache_status(cached, cache_status)
+                yield sse_event('meta', dict(cached['debug_info'], context_used=cached['context_used']))
+                yield sse_event('token', {'text': cached['response']})
+                yield sse_event('done', cached)
+                return
+
+            contexts = retrieve_contexts(user_message, question_embedding)
+            messages, context_text, token_usage = build_chat_messages(user_message, contexts)
+            result = build_chat_result('', contexts, context_text, token_usage)
+            yield sse_event('meta', dict(result['debug_info'], context_used=result['context_used'], cache='miss'))
+
+            client = get_openai_client()
+            logger.info("Sending streaming request to GPT...")
+            parts = []
+            started = time.perf_counter()
+            stream = chat_limiter.call(
+                lambda: client.chat.completions.create(
+                    model="gpt-4",
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=CHAT_MAX_COMPLETION_TOKENS,
+                    stream=True
+                ),
+                chat_request_tokens(token_usage),
+                INTERACTIVE,
+                keep_slot=True
+            )
+            # The slot is held until the stream ends, since its connection is busy until then
+            try:
+                for chunk in stream:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        if not parts:
+                            record_stage('openai_chat_first_token', time.perf_counter() - started)
+                        parts.append(text)
+                        yield sse_event('token', {'text': text})
+            finally:
+                chat_limiter.release()
+            record_stage('openai_chat', time.perf_counter() - started)
+
+            result['response'] = ''.join(parts)
+            logger.info(f"Final streamed response: {result['response'][:200]}...")
+            cache_answer(question_key, question_embedding, result, corpus_version)
+            result = with_cache_status(result, 'miss')
+            if flight:
+                flight.finish(result)
+            yield sse_event('done', result)
+        except Exception as e:
+            logger.error(f"Error in chat stream: {str(e)}")
+            yield sse_event('error', {'error': str(e)})
+        finally:
+            # Lets waiting callers compute their own answer if this one failed or the client left
+            if flight:
+                flight.abandon()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Chat answer cache. Entries are per worker and are tagged with the corpus
+# version, so any upload, delete or reset (in any worker) invalidates them.
+CHAT_CACHE_TTL = int(os.getenv('CHAT_CACHE_TTL', '3600'))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv('CHAT_CACHE_MAX_ENTRIES', '500'))
+CHAT_SEMANTIC_CACHE_ENABLED = os.getenv('CHAT_SEMANTIC_CACHE', 'false').lower() == 'true'
+CHAT_SEMANTIC_CACHE_MAX_DISTANCE = float(os.getenv('CHAT_SEMANTIC_CACHE_MAX_DISTANCE', '0.05'))
+
+chat_cache = OrderedDict()  # question key -> (expires_at, corpus_version, unit embedding, result)
+chat_cache_lock = threading.Lock()
+
+# Concurrent identical questions are answered once, in this worker through
+# a shared in-flight call and across workers through a lock file per
+# question in CHAT_COALESCING_DIR, which all workers on a host must share
+CHAT_COALESCING_ENABLED = os.getenv('CHAT_COALESCING', 'true').lower() == 'true'
+CHAT_COALESCING_DIR = os.getenv('CHAT_COALESCING_DIR', os.path.join(tempfile.gettempdir(), 'chat-coalescing'))
+CHAT_COALESCING_RESULT_TTL = float(os.getenv('CHAT_COALESCING_RESULT_TTL', '15'))
+CHAT_COALESCING_WAIT_TIMEOUT = float(os.getenv('CHAT_COALESCING_WAIT_TIMEOUT', '90'))
+
+chat_flights = SingleFlight(
+    'chat',
+    CHAT_COALESCING_DIR,
+    result_ttl=CHAT_COALESCING_RESULT_TTL,
+    wait_timeout=CHAT_COALESCING_WAIT_TIMEOUT
+)
+
+def normalize_question(question):
+    return ' '.join(question.lower().split()).rstrip('?!. ')
+
+def with_cache_status(result, status):
+    result = dict(result)
+    result['debug_info'] = dict(result.get('debug_info', {}), cache=status)
+    return result
+
+def get_cached_answer(question_key, corpus_version):
+    with chat_cache_lock:
+        entry = chat_cache.get(question_key)
+        if not entry:
+            return None
+        expires_at, version, _, result = entry
+        if expires_at < time.time() or version != corpus_version:
+            del chat_cache[question_key]
+            return None
+        chat_cache.move_to_end(question_key)
+        return result
+
+def find_similar_answer(question_embedding, corpus_version):
+    """Return the cached answer whose question is within the configured cosine distance, if any"""
+    query = np.asarray(question_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) or 1.0
+    now = time.time()
+    with chat_cache_lock:
+        live = [(key, entry) for key, entry in chat_cache.items()
+                if entry[0] >= now and entry[1] == corpus_version and entry[2] is not None]
+    if not live:
+        return None
+    similarities = np.stack([entry[2] for _, entry in live]) @ query
+    best = int(np.argmax(similarities))
+    if 1.0 - similarities[best] > CHAT_SEMANTIC_CACHE_MAX_DISTANCE:
+        return None
+    return live[best][1][3]
+
+def cache_answer(question_key, question_embedding, result, corpus_version):
+    embedding = None
+    if question_embedding is not None:
+        embedding = np.asarray(question_embedding, dtype=np.float32)
+        embedding /= np.linalg.norm(embedding) or 1.0
+    with chat_cache_lock:
+        chat_cache[question_key] = (time.time() + CHAT_CACHE_TTL, corpus_version, embedding, result)
+        chat_cache.move_to_end(question_key)
+        while len(chat_cache) > CHAT_CACHE_MAX_ENTRIES:
+            chat_cache.popitem(last=False)
+
+def get_corpus_version():
+    state = db.session.get(CorpusVersion, 1)
+    return state.version if state else 0
+
+def bump_corpus_version():
+    """Record that the indexed documents changed, invalidating cached chat answers in every worker"""
+    updated = db.session.query(CorpusVersion).filter_by(id=1).update({
+        'version': CorpusVersion.version + 1,
+        'updated_at': datetime.utcnow()
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(CorpusVersion(id=1, version=1))
+    db.session.commit()
+    with chat_cache_lock:
+        chat_cache.clear()
 
 def retrieve_documents(query):
     # Implement logic to retrieve documents from the vector database
@@ -704,15 +1570,13 @@ def retrieve_documents(query):
 @app.route('/update_demo_settings', methods=['POST'])
 def update_demo_settings():
     try:
-        # Create new demo settings
-        demo_setting = DemoSettings(
-            section_number=request.form.get('section_number'),
-            title=request.form.get('title'),
-            link=request.form.get('link'),
-            content=request.form.get('content')
-        )
-        db.session.add(demo_setting)
-        db.session.commit()
+        # Create or replace the demo section
+        save_section_settings('demo', [{
+            'section_number': request.form.get('section_number'),
+            'title': request.form.get('title'),
+            'link': request.form.get('link'),
+            'content': request.form.get('content')
+        }])
         return jsonify({'success': True, 'message': 'Settings saved successfully'})
     except Exception as e:
         db.session.rollback()
@@ -721,12 +1585,13 @@ def update_demo_settings():
 @app.route('/edit_demo_setting/<int:setting_id>', methods=['POST'])
 def edit_demo_setting(setting_id):
     try:
-        setting = DemoSettings.query.get_or_404(setting_id)
+        setting = SectionSetting.query.filter_by(id=setting_id, tenant='demo').first_or_404()
         setting.section_number = request.form.get('section_number')
         setting.title = request.form.get('title')
         setting.link = request.form.get('link')
         setting.content = request.form.get('content')
         db.session.commit()
+        invalidate_section_settings('demo')
         return jsonify({'success': True, 'message': 'Setting updated successfully'})
     except Exception as e:
         db.session.rollback()
@@ -735,9 +1600,10 @@ def edit_demo_setting(setting_id):
 @app.route('/delete_demo_setting/<int:setting_id>', methods=['POST'])
 def delete_demo_setting(setting_id):
     try:
-        setting = DemoSettings.query.get_or_404(setting_id)
+        setting = SectionSetting.query.filter_by(id=setting_id, tenant='demo').first_or_404()
         db.session.delete(setting)
         db.session.commit()
+        invalidate_section_settings('demo')
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -746,7 +1612,7 @@ def delete_demo_setting(setting_id):
 @app.route('/get_demo_settings')
 def get_demo_settings():
     try:
-        settings = DemoSettings.query.order_by(DemoSettings.section_number).all()
+        settings = SectionSetting.query.filter_by(tenant='demo').order_by(SectionSetting.section_number).all()
         return jsonify([{
             'id': s.id,
             'section_number': s.section_number,
@@ -771,46 +1637,39 @@ def get_documents():
 def delete_document(filename):
     try:
         logger.info(f"Attempting to delete document: {filename}")
-        
-        # Delete from S3
-        try:
-            s3_client = boto3.client('s3')
-            s3_client.delete_object(
+        vector_ids = get_manifest_vector_ids(filename)
+
+        # Delete from S3 and from the vector index at the same time
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            s3_future = executor.submit(
+                get_s3_client().delete_object,
                 Bucket=os.getenv('S3_BUCKET_NAME'),
                 Key=filename
             )
-            logger.info(f"Deleted {filename} from S3")
-        except Exception as e:
-            logger.error(f"Error deleting from S3: {str(e)}")
-            return jsonify({'success': False, 'message': f'Failed to delete from S3: {str(e)}'}), 500
+            vectors_future = executor.submit(delete_document_vectors, filename, vector_ids)
 
-        # Delete from Pinecone
-        try:
-            pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-            index = pc.Index(os.getenv('PINECONE_INDEX_NAME'))
-            
-            # Delete all chunks for this file
-            # First, get all vector IDs that start with the filename
-            vector_ids = [f"{filename}-chunk-{i}" for i in range(1000)]  # Adjust range as needed
-            
-            # Delete vectors in batches
-            batch_size = 100
-            for i in range(0, len(vector_ids), batch_size):
-                batch = vector_ids[i:i + batch_size]
-                try:
-                    index.delete(ids=batch)
-                except Exception as e:
-                    logger.warning(f"Error deleting batch from Pinecone: {str(e)}")
-                    
-            logger.info(f"Deleted vectors for {filename} from Pinecone")
-        except Exception as e:
-            logger.error(f"Error deleting from Pinecone: {str(e)}")
-            return jsonify({'success': False, 'message': f'Failed to delete from Pinecone: {str(e)}'}), 500
+            try:
+                s3_future.result()
+                invalidate_s3_listing()
+                logger.info(f"Deleted {filename} from S3")
+            except Exception as e:
+                logger.error(f"Error deleting from S3: {str(e)}")
+                return jsonify({'success': False, 'message': f'Failed to delete from S3: {str(e)}'}), 500
+
+            try:
+                deleted = vectors_future.result()
+                logger.info(f"Deleted {deleted} vectors for {filename} from the vector index")
+            except Exception as e:
+                logger.error(f"Error deleting from vector index: {str(e)}")
+                return jsonify({'success': False, 'message': f'Failed to delete from vector index: {str(e)}'}), 500
 
+        delete_manifest(filename)
+        bump_corpus_version()
         return jsonify({'success': True, 'message': 'Document deleted successfully'})
         
     except Exception as e:
         logger.error(f"Delete error: {str(e)}")
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/reset_database', methods=['POST'])
@@ -818,21 +1677,13 @@ def reset_database():
     try:
         # Clear S3
         logger.info("Clearing S3 bucket...")
-        bucket_name = os.getenv('S3_BUCKET_NAME')
-        s3_client = boto3.client('s3')
-        objects = s3_client.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' in objects:
-            for obj in objects['Contents']:
-                s3_client.delete_object(Bucket=bucket_name, Key=obj['Key'])
-                logger.info(f"Deleted {obj['Key']} from S3")
-        
+        deleted = delete_s3_objects(obj['Key'] for obj in iter_s3_objects())
+        logger.info(f"Deleted {deleted} objects from S3")
+
         # Clear Pinecone
         logger.info("Clearing Pinecone index...")
-        pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-        index_name = os.getenv('PINECONE_INDEX_NAME')
-        
         try:
-            index = pc.Index(index_name)
+            index = get_vector_store()
             index.delete(delete_all=True)
             logger.info("Pinecone index cleared")
         except Exception as e:
@@ -840,10 +1691,15 @@ def reset_database():
             # If the error is about namespace not found, we can ignore it
             if "Namespace not found" not in str(e):
                 raise
-        
+
+        DocumentChunk.query.delete()
+        DocumentManifest.query.delete()
+        db.session.commit()
+        bump_corpus_version()
         return jsonify({'success': True, 'message': 'Database reset successfully'})
     except Exception as e:
         logger.error(f"Error resetting database: {str(e)}")
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # Add a route to check S3 storage
@@ -851,19 +1707,12 @@ def reset_database():
 def check_s3():
     try:
         # List objects in S3 bucket
-        response = s3_client.list_objects_v2(
-            Bucket=os.getenv('S3_BUCKET_NAME')
-        )
-        
-        files = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                files.append({
-                    'filename': obj['Key'],
-                    'size': obj['Size'],
-                    'last_modified': obj['LastModified'].isoformat()
-                })
-        
+        files = [{
+            'filename': obj['Key'],
+            'size': obj['Size'],
+            'last_modified': obj['LastModified'].isoformat()
+        } for obj in iter_s3_objects()]
+
         return jsonify({
             'success': True,
             'bucket': os.getenv('S3_BUCKET_NAME'),
@@ -873,47 +1722,588 @@ def check_s3():
         logger.error(f"Error checking S3: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
-# Add this debug logging at app startup
-logger.info(f"S3 Bucket Name: {os.getenv('S3_BUCKET_NAME')}")
-logger.info(f"AWS Access Key ID exists: {bool(os.getenv('AWS_ACCESS_KEY_ID'))}")
-logger.info(f"AWS Secret Access Key exists: {bool(os.getenv('AWS_SECRET_ACCESS_KEY'))}")
+# Health checks: /healthz only says the worker is serving, /readyz checks
+# the dependencies a request needs and caches the result so frequent
+# probes don't hammer them
+READINESS_CACHE_TTL = float(os.getenv('READINESS_CACHE_TTL', '10'))
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', '5'))
 
-@app.route('/check_s3_connection', methods=['GET'])
-def check_s3_connection():
-    try:
-        bucket_name = os.getenv('S3_BUCKET_NAME')
-        logger.info(f"Checking S3 connection for bucket: {bucket_name}")
-        
-        # Try to list objects in the bucket
-        response = s3_client.list_objects_v2(
-            Bucket=bucket_name,
-            MaxKeys=1  # Just check for one object to verify access
-        )
-        
-        return jsonify({
-            'success': True,
-            'bucket_name': bucket_name,
-            'can_access': True,
-            'response': {
-                'has_contents': 'Contents' in response,
-                'count': len(response.get('Contents', []))
-            }
-        })
-    except ClientError as e:
-        logger.error(f"Error accessing S3: {str(e)}")
-        return jsonify({
-            'success': False,
-            'bucket_name': bucket_name,
-            'error': str(e)
-        }), 500
+readiness_cache = {'checked_at': None, 'ready': False, 'checks': {}}
+readiness_lock = threading.Lock()
+
+def check_database():
+    with app.app_context():
+        try:
+            db.session.execute(db.text('SELECT 1'))
+        finally:
+            db.session.remove()
+
+def check_storage():
+    get_s3_client().list_objects_v2(Bucket=os.getenv('S3_BUCKET_NAME'), MaxKeys=1)
+
+def check_vector_store():
+    return {'vectors': get_vector_store().count()}
+
+READINESS_CHECKS = {
+    'database': check_database,
+    'storage': check_storage,
+    'vector_store': check_vector_store,
+}
+
+def get_readiness_executor():
+    return get_client('readiness_executor', lambda: ThreadPoolExecutor(
+        max_workers=len(READINESS_CHECKS),
+        thread_name_prefix='readiness'
+    ))
+
+def run_readiness_checks():
+    """Run every readiness check concurrently; a check that errors or times out is not ready"""
+    executor = get_readiness_executor()
+    futures = {name: executor.submit(call_timed, check) for name, check in READINESS_CHECKS.items()}
+    deadline = time.monotonic() + READINESS_TIMEOUT
+    checks = {}
+    for name, future in futures.items():
+        try:
+            details, seconds = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            checks[name] = dict(details or {}, ok=True, ms=round(seconds * 1000, 1))
+        except FutureTimeoutError:
+            checks[name] = {'ok': False, 'error': f'No answer within {READINESS_TIMEOUT:g}s'}
+        except Exception as e:
+            checks[name] = {'ok': False, 'error': str(e)}
+    return all(check['ok'] for check in checks.values()), checks
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    with readiness_lock:
+        checked_at = readiness_cache['checked_at']
+        if checked_at is None or time.monotonic() - checked_at >= READINESS_CACHE_TTL:
+            ready, checks = run_readiness_checks()
+            if not ready:
+                logger.warning(f"Readiness check failed: {checks}")
+            readiness_cache.update(checked_at=time.monotonic(), ready=ready, checks=checks)
+        ready = readiness_cache['ready']
+        checks = readiness_cache['checks']
+        age = time.monotonic() - readiness_cache['checked_at']
+    return jsonify({
+        'status': 'ready' if ready else 'unavailable',
+        'checks': checks,
+        'checked_seconds_ago': round(age, 1)
+    }), 200 if ready else 503
 
 def get_embedding(text):
-    client = OpenAI()
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-ada-002"
+    # Questions are asked interactively, so they skip ahead of ingestion
+    embeddings, _ = embed_texts(get_openai_client(), [text], priority=INTERACTIVE)
+    return embeddings[0]
+
+# Ingestion pipeline settings
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Token budget per embeddings request and the API's hard cap on inputs per request
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', '50000'))
+EMBEDDING_BATCH_MAX_INPUTS = 2048
+UPSERT_BATCH_SIZE = 100
+UPSERT_CONCURRENCY = int(os.getenv('UPSERT_CONCURRENCY', '2'))
+
+def estimate_tokens(text):
+    """Rough token count for batching; errs on the high side for Dutch and English text"""
+    return len(text) // 3 + 1
+
+def batch_by_token_budget(texts, max_tokens=None, max_inputs=EMBEDDING_BATCH_MAX_INPUTS):
+    """Group texts into batches that stay under the embeddings request token budget"""
+    max_tokens = max_tokens or EMBEDDING_BATCH_MAX_TOKENS
+    batch = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_inputs):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def embed_batch(client, texts, priority=BULK):
+    """Embed a list of texts with a single embeddings API call, preserving input order"""
+    def create():
+        with timed('openai_embeddings'):
+            return client.embeddings.create(
+                input=texts,
+                model=EMBEDDING_MODEL
+            )
+    response = embedding_limiter.call(create, sum(estimate_tokens(text) for text in texts), priority)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+# Embedding cache, shared by all workers through the database
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '20000'))
+EMBEDDING_CACHE_LOOKUP_BATCH = 500
+
+embedding_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+embedding_cache_stats_lock = threading.Lock()
+
+def normalize_text(text):
+    return ' '.join(text.split())
+
+def embedding_cache_key(text, model=None):
+    model = model or EMBEDDING_MODEL
+    return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+def count_embedding_cache(field, amount):
+    with embedding_cache_stats_lock:
+        embedding_cache_stats[field] += amount
+
+def dialect_insert(model):
+    """INSERT construct for the active database, with ON CONFLICT support"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def load_cached_embeddings(keys):
+    """Return {key: embedding} for the keys present in the cache and mark them as recently used"""
+    found = {}
+    keys = list(keys)
+    for i in range(0, len(keys), EMBEDDING_CACHE_LOOKUP_BATCH):
+        batch = keys[i:i + EMBEDDING_CACHE_LOOKUP_BATCH]
+        rows = db.session.query(EmbeddingCacheEntry.key, EmbeddingCacheEntry.embedding).filter(
+            EmbeddingCacheEntry.key.in_(batch)
+        ).all()
+        for key, packed in rows:
+            found[key] = array('f', packed).tolist()
+    if found:
+        db.session.query(EmbeddingCacheEntry).filter(
+            EmbeddingCacheEntry.key.in_(list(found))
+        ).update({'last_used_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+    return found
+
+def store_cached_embeddings(entries):
+    """Add {key: embedding} to the cache, then evict least recently used entries over the limit"""
+    if not entries:
+        return
+    now = datetime.utcnow()
+    rows = [{
+        'key': key,
+        'model': EMBEDDING_MODEL,
+        'embedding': array('f', embedding).tobytes(),
+        'created_at': now,
+        'last_used_at': now
+    } for key, embedding in entries.items()]
+    db.session.execute(dialect_insert(EmbeddingCacheEntry).values(rows).on_conflict_do_nothing())
+
+    excess = db.session.query(func.count(EmbeddingCacheEntry.key)).scalar() - EMBEDDING_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = db.session.query(EmbeddingCacheEntry.key).order_by(
+            EmbeddingCacheEntry.last_used_at
+        ).limit(excess).subquery()
+        db.session.query(EmbeddingCacheEntry).filter(
+            EmbeddingCacheEntry.key.in_(db.select(oldest.c.key))
+        ).delete(synchronize_session=False)
+        count_embedding_cache('evictions', excess)
+    db.session.commit()
+
+def embed_texts(client, texts, priority=BULK):
+    """Embed texts, serving repeats from the embedding cache.
+
+    Only texts missing from the cache are sent to the API, in a single call.
+    Returns the embeddings in input order and the number of cache hits.
+    """
+    keys = [embedding_cache_key(text) for text in texts]
+    cached = load_cached_embeddings(set(keys))
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            missing.setdefault(key, text)
+    if missing:
+        fresh = dict(zip(missing, embed_batch(client, list(missing.values()), priority)))
+        store_cached_embeddings(fresh)
+        cached.update(fresh)
+
+    hits = len(texts) - len(missing)
+    count_embedding_cache('hits', hits)
+    count_embedding_cache('misses', len(missing))
+    return [cached[key] for key in keys], hits
+
+@app.route('/embedding_cache/stats', methods=['GET'])
+def get_embedding_cache_stats():
+    with embedding_cache_stats_lock:
+        stats = dict(embedding_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+    stats['entries'] = db.session.query(func.count(EmbeddingCacheEntry.key)).scalar()
+    stats['max_entries'] = EMBEDDING_CACHE_MAX_ENTRIES
+    return jsonify(stats)
+
+@app.route('/rate_limits/stats', methods=['GET'])
+def get_rate_limit_stats():
+    return jsonify({'embeddings': embedding_limiter.stats(), 'chat': chat_limiter.stats()})
+
+def chunk_content_hash(chunk):
+    """Hash of everything stored with a chunk's vector, so a changed page number or section also counts as a change"""
+    payload = json.dumps({'text': chunk.text, **chunk.metadata()}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def content_vector_ids(filename, content_hashes, seen=None):
+    """Content-addressed vector ids; repeated chunks in one document get an occurrence suffix.
+
+    Pass the same seen dict for every batch of one document.
+    """
+    seen = {} if seen is None else seen
+    vector_ids = []
+    for content_hash in content_hashes:
+        vector_id = f"{filename}-chunk-{content_hash[:16]}"
+        seen[vector_id] = seen.get(vector_id, 0) + 1
+        if seen[vector_id] > 1:
+            vector_id = f"{vector_id}-{seen[vector_id]}"
+        vector_ids.append(vector_id)
+    return vector_ids
+
+# Chunks indexed per batch; memory use grows with this, not with the document
+INDEX_BATCH_SIZE = int(os.getenv('INDEX_BATCH_SIZE', '500'))
+
+def index_document(filename, chunks, index, progress=None, full=False):
+    """Index a document's chunks (Chunk objects from chunk_pages) and keep its manifest in step.
+
+    Vector ids are derived from chunk content, so re-ingesting a new version
+    only embeds and upserts chunks that aren't already indexed, unless full
+    is set, and deletes the ones that disappeared. chunks may be a lazy
+    iterable and is indexed INDEX_BATCH_SIZE chunks at a time, keeping only
+    vector ids and hashes for the whole document. Each batch is written to
+    the manifest before any of it is upserted, so even a failed ingestion
+    leaves every vector it may have written discoverable for deletion. The
+    manifest is created with the first batch, so a document that yields no
+    chunks doesn't leave an empty one behind.
+    """
+    previous_ids = get_manifest_vector_ids(filename)
+    if previous_ids is None:
+        # Indexed before manifests were recorded, under positional ids
+        previous_ids = index.list_ids(prefix=f"{filename}-chunk-")
+    indexed = {} if full else get_indexed_chunk_hashes(filename)
+
+    stats = {}
+    seen = {}
+    vector_ids_written = set()
+    chunk_count = 0
+    changed_count = 0
+    chunks = (chunk for chunk in chunks if chunk.text.strip())
+    while True:
+        batch = list(itertools.islice(chunks, INDEX_BATCH_SIZE))
+        if not batch:
+            break
+        content_hashes = [chunk_content_hash(chunk) for chunk in batch]
+        vector_ids = content_vector_ids(filename, content_hashes, seen)
+        changed = [i for i, vector_id in enumerate(vector_ids) if indexed.get(vector_id) != content_hashes[i]]
+        record_manifest(filename, vector_ids, [chunk.text for chunk in batch], start_index=chunk_count)
+
+        changed_count += len(changed)
+        if changed:
+            batch_progress = None
+            if progress:
+                # Progress over all changed chunks read so far
+                def batch_progress(done, total, done_before=stats.get('chunks_upserted', 0), seen=changed_count):
+                    progress(done_before + done, seen)
+
+            batch_stats = ingest_chunks(
+                filename,
+                [batch[i].text for i in changed],
+                index,
+                vector_ids=[vector_ids[i] for i in changed],
+                metadata=[batch[i].metadata() for i in changed],
+                progress=batch_progress
+            )
+            mark_chunks_indexed({vector_ids[i]: content_hashes[i] for i in changed})
+            for key, value in batch_stats.items():
+                stats[key] = stats.get(key, 0) + value
+
+        chunk_count += len(batch)
+        vector_ids_written.update(vector_ids)
+
+    stale_ids = sorted(set(previous_ids) - vector_ids_written)
+    if stale_ids:
+        delete_vectors(index, stale_ids)
+        DocumentChunk.query.filter(DocumentChunk.vector_id.in_(stale_ids)).delete(synchronize_session=False)
+    DocumentManifest.query.filter_by(filename=filename).update({'chunk_count': chunk_count})
+    db.session.commit()
+
+    for key in ('embedding_requests', 'cache_hits', 'upsert_requests', 'chunks_upserted'):
+        stats.setdefault(key, 0)
+    for key in ('embed_seconds', 'upsert_seconds', 'total_seconds'):
+        stats[key] = round(stats.get(key, 0.0), 3)
+    stats['chunks'] = changed_count
+    stats['chunks_unchanged'] = chunk_count - changed_count
+    stats['chunks_deleted'] = len(stale_ids)
+    logger.info(
+        f"Re-indexed {filename}: {changed_count} new or changed chunks, "
+        f"{stats['chunks_unchanged']} unchanged, {len(stale_ids)} removed"
+    )
+    return stats
+
+# Document manifests record the exact vector ids written for each file
+VECTOR_DELETE_BATCH_SIZE = 1000
+
+def get_manifest_vector_ids(filename):
+    """Vector ids recorded for a file, or None if it was indexed before manifests existed"""
+    if not db.session.get(DocumentManifest, filename):
+        return None
+    return [vector_id for (vector_id,) in db.session.query(DocumentChunk.vector_id).filter_by(
+        filename=filename
+    ).order_by(DocumentChunk.chunk_index)]
+
+def get_indexed_chunk_hashes(filename):
+    """Content hashes of a file's chunks that are known to be upserted, by vector id"""
+    return dict(db.session.query(DocumentChunk.vector_id, DocumentChunk.content_hash).filter(
+        DocumentChunk.filename == filename,
+        DocumentChunk.content_hash.isnot(None)
+    ))
+
+def record_manifest(filename, vector_ids, texts, start_index=0):
+    """Add a batch of vector ids and chunk texts to a file's manifest, creating it if needed.
+
+    vector_ids[i] is chunk start_index + i of the document. Ids that are
+    already recorded keep their content hash, which marks them as upserted.
+    """
+    if not db.session.get(DocumentManifest, filename):
+        db.session.add(DocumentManifest(filename=filename))
+        db.session.flush()
+    if vector_ids:
+        statement = dialect_insert(DocumentChunk).values([
+            {'vector_id': vector_id, 'filename': filename, 'chunk_index': start_index + i, 'text': text}
+            for i, (vector_id, text) in enumerate(zip(vector_ids, texts))
+        ])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['vector_id'],
+            set_={'chunk_index': statement.excluded.chunk_index, 'text': statement.excluded.text}
+        ))
+    db.session.commit()
+
+def mark_chunks_indexed(content_hashes):
+    """Record the content hashes of chunks that were upserted, by vector id"""
+    if content_hashes:
+        db.session.execute(update(DocumentChunk), [
+            {'vector_id': vector_id, 'content_hash': content_hash}
+            for vector_id, content_hash in content_hashes.items()
+        ])
+    db.session.commit()
+
+def delete_manifest(filename):
+    DocumentChunk.query.filter_by(filename=filename).delete(synchronize_session=False)
+    DocumentManifest.query.filter_by(filename=filename).delete(synchronize_session=False)
+    db.session.commit()
+
+def delete_vectors(index, vector_ids):
+    for i in range(0, len(vector_ids), VECTOR_DELETE_BATCH_SIZE):
+        index.delete(ids=vector_ids[i:i + VECTOR_DELETE_BATCH_SIZE])
+
+def delete_document_vectors(filename, vector_ids):
+    """Delete a document's vectors, falling back to an id prefix listing when it has no manifest"""
+    index = get_vector_store()
+    if vector_ids is None:
+        vector_ids = index.list_ids(prefix=f"{filename}-chunk-")
+    delete_vectors(index, vector_ids)
+    return len(vector_ids)
+
+def ingest_chunks(filename, chunks, index, vector_ids, metadata=None, progress=None):
+    """Embed text chunks and upsert them into the vector index under the given vector_ids.
+
+    Chunks are embedded in token-budgeted batches while earlier batches are
+    upserted on a small thread pool, so the two stages overlap. metadata
+    optionally holds extra vector metadata per chunk, such as page numbers.
+    The optional progress callback receives (chunks_done, chunks_total) from
+    the calling thread. Returns per-stage timings for logging.
+    """
+    client = get_openai_client()
+    stats = {
+        'chunks': len(chunks),
+        'embedding_requests': 0,
+        'cache_hits': 0,
+        'upsert_requests': 0,
+        'chunks_upserted': 0,
+        'embed_seconds': 0.0,
+        'upsert_seconds': 0.0,
+        'total_seconds': 0.0
+    }
+    stats_lock = threading.Lock()
+
+    def upsert(vectors):
+        started = time.perf_counter()
+        index.upsert(vectors=vectors)
+        with stats_lock:
+            stats['upsert_requests'] += 1
+            stats['chunks_upserted'] += len(vectors)
+            stats['upsert_seconds'] += time.perf_counter() - started
+
+    started = time.perf_counter()
+    pending = []
+    vectors = []
+    chunk_number = 0
+    with ThreadPoolExecutor(max_workers=UPSERT_CONCURRENCY) as executor:
+        for batch in batch_by_token_budget(chunks):
+            embed_started = time.perf_counter()
+            embeddings, hits = embed_texts(client, batch)
+            stats['cache_hits'] += hits
+            if hits < len(batch):
+                stats['embedding_requests'] += 1
+            stats['embed_seconds'] += time.perf_counter() - embed_started
+            logger.info(f"Embedded chunks {chunk_number + 1}-{chunk_number + len(batch)}/{len(chunks)}")
+
+            for chunk, embedding in zip(batch, embeddings):
+                vectors.append({
+                    'id': vector_ids[chunk_number],
+                    'values': embedding,
+                    'metadata': {
+                        **(metadata[chunk_number] if metadata else {}),
+                        'text': chunk,
+                        'filename': filename
+                    }
+                })
+                chunk_number += 1
+
+            while len(vectors) >= UPSERT_BATCH_SIZE:
+                pending.append(executor.submit(upsert, vectors[:UPSERT_BATCH_SIZE]))
+                vectors = vectors[UPSERT_BATCH_SIZE:]
+
+            # Surface upsert failures early and keep the number of queued batches bounded
+            while len(pending) > UPSERT_CONCURRENCY * 2:
+                pending.pop(0).result()
+
+            if progress:
+                progress(stats['chunks_upserted'], len(chunks))
+
+        if vectors:
+            pending.append(executor.submit(upsert, vectors))
+        for future in pending:
+            future.result()
+
+    if progress:
+        progress(stats['chunks_upserted'], len(chunks))
+
+    stats['total_seconds'] = time.perf_counter() - started
+    for key in ('embed_seconds', 'upsert_seconds', 'total_seconds'):
+        stats[key] = round(stats[key], 3)
+    logger.info(
+        f"Ingested {stats['chunks']} chunks for {filename} in {stats['total_seconds']}s "
+        f"(embed {stats['embed_seconds']}s over {stats['embedding_requests']} requests, "
+        f"upsert {stats['upsert_seconds']}s over {stats['upsert_requests']} requests)"
+    )
+    return stats
+
+def list_ingest_sources(source):
+    """(filename, location) pairs for the documents in a local directory or under an s3://bucket/prefix"""
+    if source.startswith('s3://'):
+        bucket, _, prefix = source[len('s3://'):].partition('/')
+        return bucket, [
+            (obj['Key'], f"{obj['Key']}@{obj['ETag']}")
+            for obj in iter_s3_objects(bucket, prefix)
+            if allowed_file(obj['Key'])
+        ]
+    if not os.path.isdir(source):
+        raise click.BadParameter(f'{source} is not a directory or s3:// prefix', param_hint='SOURCE')
+    files = []
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if os.path.isfile(path) and allowed_file(name):
+            stat = os.stat(path)
+            files.append((path, f"{secure_filename(name)}@{stat.st_size}-{int(stat.st_mtime)}"))
+    return None, files
+
+def load_ingest_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as checkpoint:
+        return {line.strip() for line in checkpoint if line.strip()}
+
+@app.cli.command('ingest')
+@click.argument('source')
+@click.option('--workers', default=4, show_default=True, help='Documents processed in parallel.')
+@click.option('--max-rpm', type=float, default=None, help='Embeddings requests per minute across all workers.')
+@click.option('--max-tpm', type=float, default=None, help='Embeddings tokens per minute across all workers.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='File recording finished documents; documents listed in it are skipped.')
+@click.option('--upload/--no-upload', default=True, show_default=True,
+              help='Also upload local files to the S3 bucket.')
+def ingest_command(source, workers, max_rpm, max_tpm, checkpoint, upload):
+    """Ingest every supported document in a local directory or under an s3://bucket/prefix."""
+    embedding_limiter.set_rates(requests_per_minute=max_rpm, tokens_per_minute=max_tpm)
+
+    bucket, documents = list_ingest_sources(source)
+    done = load_ingest_checkpoint(checkpoint)
+    pending = [(location, key) for location, key in documents if key not in done]
+    click.echo(f"{len(documents)} documents found, {len(documents) - len(pending)} already ingested")
+
+    totals = {'documents': 0, 'failed': 0, 'pages': 0, 'chunks': 0, 'chunks_embedded': 0, 'tokens': 0}
+    totals_lock = threading.Lock()
+
+    def ingest_one(location, key):
+        filename = location if bucket else secure_filename(os.path.basename(location))
+        local_path = location
+        with app.app_context():
+            try:
+                if bucket:
+                    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(location)[1], delete=False) as temp_file:
+                        get_s3_client().download_fileobj(bucket, location, temp_file)
+                    local_path = temp_file.name
+                elif upload and not upload_local_file_to_s3(location, filename):
+                    raise RuntimeError('Failed to upload to S3')
+                stats = ingest_document(filename, local_path)
+            except Exception as e:
+                logger.error(f"Failed to ingest {location}: {str(e)}")
+                db.session.rollback()
+                with totals_lock:
+                    totals['failed'] += 1
+                return
+            finally:
+                if bucket and local_path != location:
+                    os.unlink(local_path)
+                db.session.remove()
+
+        with totals_lock:
+            totals['documents'] += 1
+            totals['pages'] += stats['pages']
+            totals['chunks'] += stats['chunks'] + stats['chunks_unchanged']
+            totals['chunks_embedded'] += stats['chunks']
+            totals['tokens'] += stats['tokens']
+            if checkpoint:
+                with open(checkpoint, 'a', encoding='utf-8') as checkpoint_file:
+                    checkpoint_file.write(key + '\n')
+        click.echo(f"Ingested {filename}: {stats['pages']} pages, {stats['chunks']} chunks embedded")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(ingest_one, location, key) for location, key in pending]:
+            future.result()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+
+    if totals['documents']:
+        bump_corpus_version()
+    click.echo(
+        f"Ingested {totals['documents']} documents ({totals['failed']} failed) in {elapsed:.1f}s: "
+        f"{totals['pages'] / elapsed:.1f} pages/s, {totals['chunks'] / elapsed:.1f} chunks/s, "
+        f"{totals['tokens'] / elapsed:.0f} {'estimated ' if TOKENS_ESTIMATED else ''}tokens/s "
+        f"({totals['chunks_embedded']} of {totals['chunks']} chunks embedded)"
+    )
+    limits = embedding_limiter.stats()
+    click.echo(
+        f"Embeddings API: {limits['calls']} calls, {limits['throttled']} throttled, "
+        f"{limits['retries']} retries, concurrency limit ended at {limits['concurrency_limit']}"
     )
-    return response.data[0].embedding
+    # Fail the run, so scripts and schedulers notice documents were skipped
+    if totals['failed']:
+        raise SystemExit(1)
+
+@app.cli.command('backfill-chunk-text')
+@click.option('--batch-size', default=100, show_default=True, help='Chunks fetched from the vector store per request.')
+def backfill_chunk_text_command(batch_size):
+    """Fill in chunk texts missing from the database from the vector store, for keyword search."""
+    filled, missing = backfill_chunk_texts(batch_size)
+    if filled:
+        bump_corpus_version()
+    click.echo(f"Filled in the text of {filled} chunks, {missing} not found in the vector store (ingest those documents again)")
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
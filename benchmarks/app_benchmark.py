@@ -0,0 +1,267 @@
+"""End-to-end latency benchmark of the Flask app against local stand-ins.
+
+Starts a fake OpenAI server, an S3 stand-in and the local vector store from
+benchmarks/fakes.py, serves app.py on a local port and drives /upload,
+/chat, /delete_document and /reset_database with synthetic PDFs, then
+prints p50/p95 latency and throughput per endpoint:
+
+    python benchmarks/app_benchmark.py
+    python benchmarks/app_benchmark.py --pages 5,50,200 --questions 100 --concurrency 8
+    python benchmarks/app_benchmark.py --chat-latency 0 --json results.json
+
+Each round uploads one document per --pages entry, asks the questions,
+deletes half of the documents and resets the database. The "ingest" row
+is the time from upload until the ingestion job has finished.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import FakeOpenAIServer, make_pdf, start_s3  # noqa: E402
+
+WORDS = (
+    'polis dekking schade verzekering premie contract artikel klant eigen risico '
+    'inboedel opstal aansprakelijkheid rechtsbijstand uitkering termijn opzegging '
+    'policy coverage claim insurer premium excess liability period cancellation'
+).split()
+
+BUCKET_NAME = 'benchmark-bucket'
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def synthetic_document(page_count, seed):
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(1, page_count + 1):
+        lines = [f'{page_number}. {rng.choice(WORDS).upper()} {rng.choice(WORDS).upper()}']
+        for paragraph in range(rng.randint(3, 5)):
+            for _ in range(rng.randint(4, 8)):
+                lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 12))) + '.')
+            lines.append(f'Artikel {page_number}.{paragraph + 1} code BX-{rng.randint(100, 999)}.')
+            lines.append('')
+        pages.append('\n'.join(lines))
+    return make_pdf(pages)
+
+def questions(count, seed):
+    rng = random.Random(seed)
+    return [
+        f'Wat zegt artikel {rng.randint(1, 20)}.{rng.randint(1, 5)} over {rng.choice(WORDS)} '
+        f'en {rng.choice(WORDS)} bij {rng.choice(WORDS)}? ({i})'
+        for i in range(count)
+    ]
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # name -> list of seconds
+        self.errors = {}
+        self.wall = {}  # name -> seconds the phase took
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, ok=True):
+        with self.lock:
+            self.samples.setdefault(name, [])
+            self.errors.setdefault(name, 0)
+            if ok:
+                self.samples[name].append(seconds)
+            else:
+                self.errors[name] += 1
+
+    def add_wall(self, name, seconds):
+        with self.lock:
+            self.wall[name] = self.wall.get(name, 0.0) + seconds
+
+    def summary(self):
+        rows = []
+        for name, samples in self.samples.items():
+            wall = self.wall.get(name) or sum(samples) or 1e-9
+            rows.append({
+                'endpoint': name,
+                'requests': len(samples),
+                'errors': self.errors[name],
+                'p50_ms': percentile(samples, 0.50) * 1000 if samples else None,
+                'p95_ms': percentile(samples, 0.95) * 1000 if samples else None,
+                'mean_ms': sum(samples) / len(samples) * 1000 if samples else None,
+                'max_ms': max(samples) * 1000 if samples else None,
+                'throughput_per_s': len(samples) / wall
+            })
+        return rows
+
+def print_summary(rows):
+    print(f"{'endpoint':<16}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'mean ms':>10}{'max ms':>10}{'per s':>9}")
+    for row in rows:
+        def ms(value):
+            return f'{value:10.1f}' if value is not None else f"{'-':>10}"
+        print(f"{row['endpoint']:<16}{row['requests']:>9}{row['errors']:>8}{ms(row['p50_ms'])}"
+              f"{ms(row['p95_ms'])}{ms(row['mean_ms'])}{ms(row['max_ms'])}{row['throughput_per_s']:9.2f}")
+
+def stage_summary(metrics):
+    """Mean and total seconds per stage from the app's own stage histogram"""
+    totals = {}
+    with metrics.stage_seconds.lock:
+        for (stage, _route), series in metrics.stage_seconds.series.items():
+            count, seconds = totals.get(stage, (0, 0.0))
+            totals[stage] = (count + series[-2], seconds + series[-1])
+    return {
+        stage: {'calls': count, 'mean_ms': seconds / count * 1000, 'total_s': seconds}
+        for stage, (count, seconds) in sorted(totals.items(), key=lambda item: -item[1][1]) if count
+    }
+
+def run_phase(recorder, names, function, items, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(function, items))
+    for name in names:
+        recorder.add_wall(name, time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', default='2,20,100', help='comma separated page counts, one document per entry')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--questions', type=int, default=30, help='chat questions per round')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients per phase')
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help='seconds per embeddings call')
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='seconds per chat completion')
+    parser.add_argument('--openai-rpm', type=int, default=0, help='answer 429 beyond this many OpenAI calls per minute')
+    parser.add_argument('--s3-latency', type=float, default=0.01, help='seconds per S3 call (in-memory stand-in only)')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite database')
+    parser.add_argument('--job-timeout', type=float, default=300)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+    page_counts = [int(pages) for pages in args.pages.split(',') if pages.strip()]
+
+    workdir = tempfile.mkdtemp(prefix='app-benchmark-')
+    openai_server = FakeOpenAIServer(
+        embedding_latency=args.embedding_latency,
+        chat_latency=args.chat_latency,
+        max_rpm=args.openai_rpm
+    ).start()
+    s3_backend, stop_s3 = start_s3(BUCKET_NAME, latency=args.s3_latency)
+
+    # app.py reads its configuration at import time
+    os.environ.update({
+        'VECTOR_STORE_BACKEND': 'local',
+        'LOCAL_VECTOR_STORE_PATH': os.path.join(workdir, 'vectors'),
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        'OPENAI_API_KEY': 'sk-benchmark',
+        'OPENAI_BASE_URL': openai_server.base_url,
+        'S3_BUCKET_NAME': BUCKET_NAME,
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'NO_PROXY': '127.0.0.1,localhost',
+    })
+    os.chdir(ROOT)
+    import logging
+    import httpx
+    from werkzeug.serving import make_server
+    import app as application
+    import metrics
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with application.app.app_context():
+        application.db.create_all()
+    server = make_server('127.0.0.1', 0, application.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = httpx.Client(base_url=f'http://127.0.0.1:{server.server_port}', timeout=args.job_timeout, trust_env=False)
+    print(f"Serving app on port {server.server_port}, OpenAI stand-in at {openai_server.base_url}, S3: {s3_backend}")
+
+    recorder = Recorder()
+    documents = {pages: synthetic_document(pages, seed=pages) for pages in page_counts}
+
+    def upload(item):
+        round_number, pages = item
+        filename = f'benchmark-r{round_number}-{pages}p.pdf'
+        started = time.perf_counter()
+        while True:
+            response = client.post('/upload', files={'file': (filename, documents[pages], 'application/pdf')})
+            if response.status_code != 503:
+                break
+            time.sleep(0.2)  # ingestion queue full, as a browser would retry
+        recorder.add('upload', time.perf_counter() - started, response.status_code == 202)
+        if response.status_code != 202:
+            print(f"Upload of {filename} failed: {response.text[:200]}")
+            return
+        job_id = response.json()['job_id']
+        deadline = time.monotonic() + args.job_timeout
+        while time.monotonic() < deadline:
+            job = client.get(f'/jobs/{job_id}').json()
+            if job['status'] in ('completed', 'failed'):
+                break
+            time.sleep(0.05)
+        ok = job['status'] == 'completed'
+        recorder.add('ingest', time.perf_counter() - started, ok)
+        recorder.add(f'ingest {pages}p', time.perf_counter() - started, ok)
+        if not ok:
+            print(f"Ingestion of {filename} did not complete: {job['status']} {job.get('error')}")
+
+    def chat(question):
+        started = time.perf_counter()
+        response = client.post('/chat', json={'message': question})
+        recorder.add('chat', time.perf_counter() - started, response.status_code == 200 and 'error' not in response.json())
+
+    def delete(filename):
+        started = time.perf_counter()
+        response = client.delete(f'/delete_document/{filename}')
+        recorder.add('delete_document', time.perf_counter() - started, response.status_code == 200)
+
+    try:
+        for round_number in range(args.rounds):
+            run_phase(
+                recorder,
+                ['upload', 'ingest'] + [f'ingest {pages}p' for pages in page_counts],
+                upload,
+                [(round_number, pages) for pages in page_counts],
+                args.concurrency
+            )
+            run_phase(recorder, ['chat'], chat, questions(args.questions, seed=round_number), args.concurrency)
+            filenames = [f'benchmark-r{round_number}-{pages}p.pdf' for pages in page_counts]
+            run_phase(recorder, ['delete_document'], delete, filenames[::2], args.concurrency)
+
+            started = time.perf_counter()
+            response = client.post('/reset_database')
+            recorder.add('reset_database', time.perf_counter() - started, response.status_code == 200)
+            print(f"Round {round_number + 1}/{args.rounds} done")
+    finally:
+        server.shutdown()
+        openai_server.stop()
+        stop_s3()
+
+    rows = recorder.summary()
+    print()
+    print_summary(rows)
+    stages = stage_summary(metrics)
+    print()
+    print(f"{'stage':<32}{'calls':>8}{'mean ms':>10}{'total s':>10}")
+    for stage, values in stages.items():
+        print(f"{stage:<32}{values['calls']:>8}{values['mean_ms']:10.1f}{values['total_s']:10.2f}")
+    print()
+    print(f"OpenAI stand-in served {openai_server.calls['embeddings']} embeddings calls "
+          f"({openai_server.calls['embedding_inputs']} inputs) and {openai_server.calls['chat']} chat calls, "
+          f"and throttled {openai_server.calls['throttled']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({
+                'arguments': vars(args),
+                's3_backend': s3_backend,
+                'endpoints': rows,
+                'stages': stages,
+                'openai_calls': openai_server.calls
+            }, output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compare the ingestion chunker against the fixed-size strategies it replaced.
+
+Runs each strategy over synthetic pages (or the pages of a PDF) and prints
+throughput, chunk count and chunk size in tokens:
+
+    python benchmarks/chunking_benchmark.py
+    python benchmarks/chunking_benchmark.py --pdf some.pdf --repeat 5
+"""
+import argparse
+import os
+import random
+import sys
+import textwrap
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import _encoding, chunk_pages, count_tokens  # noqa: E402
+
+WORDS = (
+    'de het een polis dekking schade verzekering premie contract artikel klant '
+    'the policy coverage claim insurer premium contract article customer period'
+).split()
+
+def synthetic_pages(page_count, seed=1):
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(1, page_count + 1):
+        lines = [f'{page_number}. {rng.choice(WORDS).upper()} {rng.choice(WORDS).upper()}']
+        for _ in range(rng.randint(3, 6)):
+            for _ in range(rng.randint(4, 10)):
+                lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 14))) + '.')
+            lines.append('')
+        pages.append((page_number, '\n'.join(lines)))
+    return pages
+
+def pdf_pages(path):
+    from extraction import extract_pdf_pages
+    return extract_pdf_pages(path)
+
+def textwrap_per_page(pages):
+    """Former upload path: textwrap.wrap(text, 1000) on each page"""
+    chunks = []
+    for _, text in pages:
+        chunks.extend(textwrap.wrap(text, 1000))
+    return chunks
+
+def concat_and_slice(pages):
+    """Former process_file path: concatenate every page, then 1000-character slices"""
+    text = ''
+    for _, page_text in pages:
+        text += page_text
+    return [text[i:i + 1000] for i in range(0, len(text), 1000)]
+
+def token_chunker(pages):
+    return [chunk.text for chunk in chunk_pages(pages)]
+
+STRATEGIES = [
+    ('textwrap per page', textwrap_per_page),
+    ('concat + slice', concat_and_slice),
+    ('token chunker', token_chunker),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdf', help='Chunk the pages of this PDF instead of synthetic text')
+    parser.add_argument('--pages', type=int, default=200, help='Number of synthetic pages')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per strategy; the fastest is reported')
+    args = parser.parse_args()
+
+    pages = pdf_pages(args.pdf) if args.pdf else synthetic_pages(args.pages)
+    megabytes = sum(len(text.encode('utf-8')) for _, text in pages) / 1e6
+    print(f"{len(pages)} pages, {megabytes:.2f} MB, tokens "
+          f"{'counted with tiktoken' if _encoding is not None else 'estimated from length'}")
+    print(f"{'strategy':<20}{'seconds':>10}{'MB/s':>10}{'chunks':>10}{'mean tok':>10}{'max tok':>10}")
+
+    for name, strategy in STRATEGIES:
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            chunks = strategy(pages)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        tokens = [count_tokens(chunk) for chunk in chunks] or [0]
+        print(f"{name:<20}{best:>10.4f}{megabytes / best:>10.1f}{len(chunks):>10}"
+              f"{sum(tokens) / len(tokens):>10.0f}{max(tokens):>10}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""Local stand-ins for the services app.py talks to, for offline benchmarks.
+
+FakeOpenAIServer speaks enough of the OpenAI HTTP API for the app's
+embeddings and chat calls (streamed or not), with a configurable delay per
+call. Embeddings are deterministic hashed bags of words, so texts that share
+words are close in embedding space and retrieval still finds sensible
+contexts. InMemoryS3 covers the boto3 S3 client calls the app makes; moto
+is used instead when it is installed. The vector index is the app's own
+LocalVectorStore, selected with VECTOR_STORE_BACKEND=local.
+"""
+import base64
+import datetime
+import hashlib
+import io
+import json
+import re
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBEDDING_DIMENSION = 1536
+WORD = re.compile(r'\w+')
+
+def fake_embedding(text, dimension=EMBEDDING_DIMENSION):
+    """Unit vector with one signed slot per word of the text"""
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+        slot = int.from_bytes(digest[:4], 'little') % dimension
+        vector[slot] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if not norm:
+        vector[0] = norm = 1.0
+    return vector / norm
+
+class FakeOpenAIServer:
+    """Threaded HTTP server for /v1/embeddings and /v1/chat/completions.
+
+    Point the app at it with OPENAI_BASE_URL=server.base_url. Each call
+    sleeps for the configured latency plus a per-input or per-chunk delay
+    before answering, and the server counts the calls it served. With
+    max_rpm set, calls beyond that many in the last minute get a 429 with
+    a Retry-After header, like the real API.
+    """
+
+    def __init__(self, embedding_latency=0.05, embedding_latency_per_input=0.001,
+                 chat_latency=0.5, stream_chunk_delay=0.01, answer_words=120, max_rpm=0):
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.chat_latency = chat_latency
+        self.stream_chunk_delay = stream_chunk_delay
+        self.answer_words = answer_words
+        self.max_rpm = max_rpm
+        self.recent_calls = []  # monotonic times of the calls in the last minute
+        self.calls = {'embeddings': 0, 'embedding_inputs': 0, 'chat': 0, 'throttled': 0}
+        self.calls_lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name, amount=1):
+        with self.calls_lock:
+            self.calls[name] += amount
+
+    def throttle(self):
+        """Seconds until the call would be allowed, or None to serve it now"""
+        if not self.max_rpm:
+            return None
+        with self.calls_lock:
+            now = time.monotonic()
+            self.recent_calls = [at for at in self.recent_calls if now - at < 60]
+            if len(self.recent_calls) >= self.max_rpm:
+                self.calls['throttled'] += 1
+                return 60 - (now - self.recent_calls[0])
+            self.recent_calls.append(now)
+            return None
+
+    def answer(self, messages):
+        question = messages[-1]['content'] if messages else ''
+        words = WORD.findall(question)[-12:] or ['document']
+        body = ' '.join(words[i % len(words)] for i in range(self.answer_words))
+        return f'<div><h2>Antwoord</h2><p>{body}</p></div>'
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                retry_after = fake.throttle()
+                if retry_after is not None:
+                    self.send_json(
+                        {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                        status=429,
+                        headers={'retry-after-ms': str(int(retry_after * 1000))}
+                    )
+                elif self.path.endswith('/embeddings'):
+                    self.embeddings(payload)
+                elif self.path.endswith('/chat/completions'):
+                    self.chat(payload)
+                else:
+                    self.send_json({'error': {'message': f'Unknown path {self.path}'}}, status=404)
+
+            def send_json(self, body, status=200, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def embeddings(self, payload):
+                inputs = payload.get('input')
+                inputs = inputs if isinstance(inputs, list) else [inputs]
+                fake.count('embeddings')
+                fake.count('embedding_inputs', len(inputs))
+                time.sleep(fake.embedding_latency + fake.embedding_latency_per_input * len(inputs))
+                data = []
+                for i, text in enumerate(inputs):
+                    vector = fake_embedding(text)
+                    if payload.get('encoding_format') == 'base64':
+                        embedding = base64.b64encode(vector.astype('<f4').tobytes()).decode('ascii')
+                    else:
+                        embedding = vector.tolist()
+                    data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+                tokens = sum(len(text) // 4 + 1 for text in inputs)
+                self.send_json({
+                    'object': 'list',
+                    'data': data,
+                    'model': payload.get('model'),
+                    'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+                })
+
+            def chat(self, payload):
+                fake.count('chat')
+                text = fake.answer(payload.get('messages') or [])
+                created = int(time.time())
+                if not payload.get('stream'):
+                    time.sleep(fake.chat_latency)
+                    self.send_json({
+                        'id': 'chatcmpl-fake',
+                        'object': 'chat.completion',
+                        'created': created,
+                        'model': payload.get('model'),
+                        'choices': [{
+                            'index': 0,
+                            'message': {'role': 'assistant', 'content': text},
+                            'finish_reason': 'stop'
+                        }],
+                        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                # Time to first token is the configured latency, the rest trickles in
+                time.sleep(fake.chat_latency)
+                pieces = [text[i:i + 16] for i in range(0, len(text), 16)]
+                for i, piece in enumerate(pieces):
+                    chunk = {
+                        'id': 'chatcmpl-fake',
+                        'object': 'chat.completion.chunk',
+                        'created': created,
+                        'model': payload.get('model'),
+                        'choices': [{
+                            'index': 0,
+                            'delta': {'content': piece},
+                            'finish_reason': 'stop' if i == len(pieces) - 1 else None
+                        }]
+                    }
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                    time.sleep(fake.stream_chunk_delay)
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+class InMemoryS3:
+    """The subset of the boto3 S3 client used by app.py, backed by a dict.
+
+    Objects are shared by every client built in the process, like a real
+    bucket. Calls take latency seconds each to stand in for the round trip.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}  # (bucket, key) -> (bytes, last modified)
+        self.lock = threading.Lock()
+
+    def client(self, *args, **kwargs):
+        return self
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _put(self, bucket, key, data):
+        with self.lock:
+            self.objects[(bucket, key)] = (data, datetime.datetime.now(datetime.timezone.utc))
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self._wait()
+        self._put(Bucket, Key, Fileobj.read())
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, 'rb') as file_data:
+            self.upload_fileobj(file_data, Bucket, Key)
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Callback=None, Config=None):
+        self._wait()
+        with self.lock:
+            data = self.objects[(Bucket, Key)][0]
+        shutil.copyfileobj(io.BytesIO(data), Fileobj)
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, 'wb') as file_data:
+            self.download_fileobj(Bucket, Key, file_data)
+
+    def delete_object(self, Bucket, Key):
+        self._wait()
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        self._wait()
+        deleted = []
+        with self.lock:
+            for item in Delete['Objects']:
+                self.objects.pop((Bucket, item['Key']), None)
+                deleted.append({'Key': item['Key']})
+        return {} if Delete.get('Quiet') else {'Deleted': deleted}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self._wait()
+        with self.lock:
+            keys = sorted(
+                (key, data, modified) for (bucket, key), (data, modified) in self.objects.items()
+                if bucket == Bucket and key.startswith(Prefix) and (not ContinuationToken or key > ContinuationToken)
+            )
+        page = keys[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > MaxKeys,
+            'Contents': [
+                {'Key': key, 'Size': len(data), 'LastModified': modified, 'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+                for key, data, modified in page
+            ]
+        }
+        if not page:
+            del response['Contents']
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1][0]
+        return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        return _ListObjectsPaginator(self)
+
+class _ListObjectsPaginator:
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.s3.list_objects_v2(ContinuationToken=token, **kwargs)
+            yield page
+            if not page['IsTruncated']:
+                return
+            token = page['NextContinuationToken']
+
+def start_s3(bucket_name, latency=0.0):
+    """Stand in for S3 until the returned stop function is called.
+
+    Uses moto's mock when it is installed, and otherwise routes
+    boto3.client('s3') to a process-wide InMemoryS3.
+    """
+    import boto3
+    try:
+        from moto import mock_aws
+    except ImportError:
+        mock_aws = None
+
+    if mock_aws is not None:
+        mock = mock_aws()
+        mock.start()
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=bucket_name)
+        return 'moto', mock.stop
+
+    store = InMemoryS3(latency=latency)
+    original_client = boto3.client
+
+    def client(service_name, *args, **kwargs):
+        if service_name == 's3':
+            return store
+        return original_client(service_name, *args, **kwargs)
+
+    boto3.client = client
+
+    def stop():
+        boto3.client = original_client
+    return 'in-memory', stop
+
+def make_pdf(pages):
+    """Build a minimal PDF with one page per string, one text line per line of the string"""
+    def escape(line):
+        return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    out = [b'%PDF-1.4\n']
+    offsets = {}
+
+    def add(number, content):
+        offsets[number] = sum(len(part) for part in out)
+        out.append(b'%d 0 obj\n' % number + content + b'\nendobj\n')
+
+    page_numbers = list(range(4, 4 + 2 * len(pages), 2))
+    add(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    add(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % number for number in page_numbers), len(pages)))
+    add(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    for number, text in zip(page_numbers, pages):
+        operations = 'BT /F1 9 Tf 11 TL 40 760 Td ' + ' '.join(
+            f'({escape(line)}) Tj T*' for line in text.split('\n')) + ' ET'
+        stream = operations.encode('latin-1', 'replace')
+        add(number, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                    b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (number + 1))
+        add(number + 1, b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+
+    size = 4 + 2 * len(pages)
+    xref = sum(len(part) for part in out)
+    out.append(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+    for number in range(1, size):
+        out.append(b'%010d 00000 n \n' % offsets[number])
+    out.append(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref))
+    return b''.join(out)
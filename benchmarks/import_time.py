@@ -0,0 +1,93 @@
+"""Measure how long a worker takes to import app.py and fail above a budget.
+
+Every gunicorn worker imports the app before it serves its first request,
+so this is the floor on cold start and restart time. Each run imports the
+app in a fresh interpreter with dummy credentials, which also catches any
+network call creeping back into import time: there is nothing to connect to.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 5 --budget 1.5 --top 20
+
+Exits with status 1 when the median import time is over the budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_TIME_BUDGET = float(os.getenv('IMPORT_TIME_BUDGET', '2.0'))
+
+SCRIPT = '''
+import time
+started = time.perf_counter()
+import app
+print(f"IMPORT_SECONDS {time.perf_counter() - started:.6f}")
+'''
+
+def import_once(env):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing app failed:\n{result.stderr[-2000:]}")
+    seconds = next(float(line.split()[1]) for line in result.stdout.splitlines() if line.startswith('IMPORT_SECONDS'))
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name[1:].rstrip()
+        modules.append((int(cumulative_us), int(self_us), len(name) - len(name.lstrip()), name.strip()))
+    return seconds, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET, help='seconds for the median run')
+    parser.add_argument('--top', type=int, default=15, help='slowest top-level imports to list')
+    parser.add_argument('--backend', default='pinecone', choices=('pinecone', 'local'), help='VECTOR_STORE_BACKEND')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='import-time-')
+    env = dict(
+        os.environ,
+        VECTOR_STORE_BACKEND=args.backend,
+        LOCAL_VECTOR_STORE_PATH=os.path.join(workdir, 'vectors'),
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'import.db')}",
+        OPENAI_API_KEY='sk-import-time',
+        PINECONE_API_KEY='import-time',
+        PINECONE_INDEX_NAME='import-time',
+        S3_BUCKET_NAME='import-time',
+        # Unroutable, so a connection attempt at import time fails fast instead of passing
+        HTTPS_PROXY='http://127.0.0.1:9',
+        HTTP_PROXY='http://127.0.0.1:9',
+    )
+
+    # The first run warms the bytecode and OS file caches and isn't counted
+    import_once(env)
+    runs = [import_once(env) for _ in range(args.runs)]
+    timings = [seconds for seconds, _ in runs]
+    median = statistics.median(timings)
+
+    _, modules = min(runs, key=lambda run: abs(run[0] - median))
+    # app itself and the modules it imports directly
+    top_level = [module for module in modules if module[2] <= 2]
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for cumulative_us, self_us, _, name in sorted(top_level, reverse=True)[:args.top]:
+        print(f'{cumulative_us / 1000:14.1f}{self_us / 1000:10.1f}  {name}')
+    print()
+    print(f"Import time over {args.runs} runs: median {median:.3f}s, "
+          f"min {min(timings):.3f}s, max {max(timings):.3f}s (budget {args.budget:.3f}s)")
+
+    if median > args.budget:
+        print(f"Import time is over budget by {median - args.budget:.3f}s")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
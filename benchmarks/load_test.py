@@ -0,0 +1,166 @@
+"""Concurrent /chat load test comparing gunicorn worker configurations.
+
+Seeds a local vector store with a synthetic document, then serves app.py
+with gunicorn once per configuration on the same machine and keeps
+--concurrency clients asking distinct questions for --duration seconds.
+OpenAI is the stand-in from benchmarks/fakes.py, so every chat spends
+--chat-latency seconds waiting on it, like a real completion:
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --concurrency 64 --threads 64 --chat-latency 2
+
+The default run compares one sync worker with one gthread worker.
+"""
+import argparse
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app_benchmark import percentile, questions, synthetic_document  # noqa: E402
+from fakes import FakeOpenAIServer  # noqa: E402
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def seed_corpus(workdir, page_count):
+    """Index one synthetic document through the app's own ingestion code"""
+    import app as application
+
+    path = os.path.join(workdir, 'load-test.pdf')
+    with open(path, 'wb') as pdf:
+        pdf.write(synthetic_document(page_count, seed=1))
+    with application.app.app_context():
+        application.db.create_all()
+        stats = application.ingest_document('load-test.pdf', path)
+        application.bump_corpus_version()
+    return stats
+
+def run_load(base_url, concurrency, duration, question_pool):
+    import httpx
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = itertools.count()
+    client = httpx.Client(
+        base_url=base_url,
+        timeout=300,
+        trust_env=False,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    )
+    deadline = time.monotonic() + duration
+
+    def user():
+        while time.monotonic() < deadline:
+            question = question_pool[next(counter) % len(question_pool)]
+            started = time.perf_counter()
+            try:
+                response = client.post('/chat', json={'message': question})
+                ok = response.status_code == 200
+                failure = None if ok else f'HTTP {response.status_code}'
+            except Exception as e:
+                ok, failure = False, type(e).__name__
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors.append(failure)
+
+    started = time.perf_counter()
+    users = [threading.Thread(target=user) for _ in range(concurrency)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    client.close()
+    return latencies, errors, elapsed
+
+def serve(worker_class, workers, threads, env):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'app:app'],
+        cwd=ROOT,
+        env=dict(env, PORT=str(port), WEB_CONCURRENCY=str(workers),
+                 GUNICORN_WORKER_CLASS=worker_class, GUNICORN_THREADS=str(threads)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    import httpx
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        try:
+            if httpx.get(f'{base_url}/healthz', trust_env=False).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            raise SystemExit(f'gunicorn exited with status {process.returncode}')
+        time.sleep(0.1)
+    process.terminate()
+    raise SystemExit('gunicorn did not start within 30s')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent chat users')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per configuration')
+    parser.add_argument('--chat-latency', type=float, default=1.0, help='seconds the OpenAI stand-in takes per answer')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers in every configuration')
+    parser.add_argument('--threads', type=int, default=32, help='threads per gthread worker')
+    parser.add_argument('--configs', default='sync,gthread', help='worker classes to compare')
+    parser.add_argument('--pages', type=int, default=20, help='pages in the seeded document')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite database')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    openai_server = FakeOpenAIServer(embedding_latency=0.05, chat_latency=args.chat_latency).start()
+    os.environ.update({
+        'VECTOR_STORE_BACKEND': 'local',
+        'LOCAL_VECTOR_STORE_PATH': os.path.join(workdir, 'vectors'),
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'load-test.db')}",
+        'OPENAI_API_KEY': 'sk-load-test',
+        'OPENAI_BASE_URL': openai_server.base_url,
+        'S3_BUCKET_NAME': 'load-test',
+        'NO_PROXY': '127.0.0.1,localhost',
+    })
+    stats = seed_corpus(workdir, args.pages)
+    print(f"Seeded {stats['chunks']} chunks; OpenAI stand-in answers in {args.chat_latency:g}s")
+
+    # Enough distinct questions that the chat cache never answers
+    question_pool = questions(20000, seed=7)
+    results = []
+    try:
+        for worker_class in [name.strip() for name in args.configs.split(',') if name.strip()]:
+            threads = args.threads if worker_class == 'gthread' else 1
+            process, base_url = serve(worker_class, args.workers, threads, dict(os.environ))
+            try:
+                latencies, errors, elapsed = run_load(base_url, args.concurrency, args.duration, question_pool)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+            results.append((f'{args.workers}x {worker_class} ({threads} thread{"s" if threads > 1 else ""})',
+                            latencies, errors, elapsed))
+            question_pool = question_pool[len(latencies) + len(errors):]
+    finally:
+        openai_server.stop()
+
+    print()
+    print(f"{args.concurrency} concurrent users for {args.duration:g}s each")
+    print(f"{'configuration':<28}{'chats':>7}{'errors':>8}{'per s':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, latencies, errors, elapsed in results:
+        p50 = f'{percentile(latencies, 0.50) * 1000:10.0f}' if latencies else f"{'-':>10}"
+        p95 = f'{percentile(latencies, 0.95) * 1000:10.0f}' if latencies else f"{'-':>10}"
+        print(f"{name:<28}{len(latencies):>7}{len(errors):>8}{len(latencies) / elapsed:8.2f}{p50}{p95}")
+
+if __name__ == '__main__':
+    main()
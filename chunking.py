@@ -0,0 +1,202 @@
+"""Token-aware chunking of extracted document text.
+
+Pages are split into paragraphs, oversized paragraphs into sentences and
+then words, and the pieces are packed into chunks of at most
+CHUNK_MAX_TOKENS tokens with up to CHUNK_OVERLAP_TOKENS of trailing context
+carried into the next chunk, cutting the last piece at a sentence or word
+when it doesn't fit whole. A line that looks like a heading starts a new
+chunk and becomes the section of the chunks after it, unless it follows
+another such line, as the items of a short numbered list do. Tokens are
+counted with tiktoken when it is installed and estimated otherwise.
+"""
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '300'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '40'))
+# Encoding used by text-embedding-ada-002 and the text-embedding-3 models
+CHUNK_TOKEN_ENCODING = os.getenv('CHUNK_TOKEN_ENCODING', 'cl100k_base')
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding(CHUNK_TOKEN_ENCODING)
+except Exception:  # not installed, or the encoding can't be downloaded
+    _encoding = None
+    logger.warning("tiktoken unavailable, estimating token counts from text length")
+
+# True when count_tokens returns the length-based estimate instead of a real count
+TOKENS_ESTIMATED = _encoding is None
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+NUMBERED_HEADING = re.compile(r'^(\d+(\.\d+)*\.?|[IVX]+\.|[A-Z]\.)\s+\S')
+MAX_HEADING_LENGTH = 80
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 3 + 1
+
+def is_heading(line):
+    """Heuristic for the headings PDF extraction leaves on a line of their own"""
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_LENGTH or line[-1] in '.,;':
+        return False
+    if NUMBERED_HEADING.match(line):
+        return len(line.split()) <= 12
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 3 and all(c.isupper() for c in letters)
+
+class Chunk:
+    def __init__(self, text, page_start, page_end, section=None, tokens=0):
+        self.text = text
+        self.page_start = page_start
+        self.page_end = page_end
+        self.section = section
+        self.tokens = tokens
+
+    def metadata(self):
+        """Vector metadata for this chunk; Pinecone rejects null values, so section is left out when unknown"""
+        metadata = {'page_start': self.page_start, 'page_end': self.page_end}
+        if self.section:
+            metadata['section'] = self.section
+        return metadata
+
+    def __repr__(self):
+        return f'<Chunk p{self.page_start}-{self.page_end} {self.tokens} tokens>'
+
+def _split_oversized(text, max_tokens):
+    """Break a piece longer than max_tokens into sentences, then words, then characters"""
+    for pattern in (SENTENCE_END, re.compile(r'\s+')):
+        parts = [part for part in pattern.split(text) if part]
+        if len(parts) > 1:
+            pieces = []
+            for part in parts:
+                tokens = count_tokens(part)
+                if tokens > max_tokens:
+                    pieces.extend(_split_oversized(part, max_tokens))
+                else:
+                    pieces.append((part, tokens))
+            return pieces
+    # One unbroken run of characters, e.g. a table flattened by extraction
+    step = max(1, len(text) * max_tokens // count_tokens(text))
+    return [(text[i:i + step], count_tokens(text[i:i + step])) for i in range(0, len(text), step)]
+
+def _tail(text, max_tokens):
+    """The trailing whole sentences of text within max_tokens, or its trailing words if no sentence fits"""
+    for pattern in (SENTENCE_END, re.compile(r'\s+')):
+        parts = [part for part in pattern.split(text) if part]
+        tail = ''
+        for part in reversed(parts):
+            candidate = f'{part} {tail}' if tail else part
+            if count_tokens(candidate) > max_tokens:
+                break
+            tail = candidate
+        if tail:
+            return tail
+    return ''
+
+def _pieces(pages, max_tokens, detect_headings=True):
+    """Yield (text, tokens, page_number, heading, separator) for each paragraph-sized piece of the pages.
+
+    The separator joins the piece to the one before it: a newline between
+    paragraphs and a space between the parts of a split paragraph.
+    """
+    for page_number, text in pages:
+        for paragraph in PARAGRAPH_BREAK.split(text or ''):
+            lines = []
+            for line in paragraph.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                if detect_headings and is_heading(line):
+                    if lines:
+                        yield from _paragraph_pieces(' '.join(lines), page_number, max_tokens)
+                        lines = []
+                    yield line, count_tokens(line), page_number, True, '\n'
+                else:
+                    lines.append(line)
+            if lines:
+                yield from _paragraph_pieces(' '.join(lines), page_number, max_tokens)
+
+def _paragraph_pieces(paragraph, page_number, max_tokens):
+    tokens = count_tokens(paragraph)
+    if tokens <= max_tokens:
+        yield paragraph, tokens, page_number, False, '\n'
+        return
+    for i, (piece, piece_tokens) in enumerate(_split_oversized(paragraph, max_tokens)):
+        yield piece, piece_tokens, page_number, False, ' ' if i else '\n'
+
+def chunk_pages(pages, max_tokens=None, overlap_tokens=None, detect_headings=True):
+    """Lazily chunk an iterable of (page_number, text) tuples.
+
+    Yields Chunk objects in document order. Token counts are per piece, so a
+    chunk's total can differ from counting its joined text by a token or so
+    per piece boundary. detect_headings=False treats every line as text, for
+    sources such as spreadsheet rows where an all-caps line isn't a heading.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    if overlap_tokens >= max_tokens:
+        raise ValueError('Chunk overlap must be smaller than the chunk size')
+
+    section = None
+    current = []  # (text, tokens, page_number, separator)
+    current_tokens = 0
+    has_new_text = False
+
+    def emit():
+        return Chunk(
+            ''.join(separator + text if i else text for i, (text, _, _, separator) in enumerate(current)),
+            current[0][2],
+            current[-1][2],
+            section,
+            current_tokens
+        )
+
+    def carry_overlap():
+        carried = []
+        carried_tokens = 0
+        for text, tokens, page_number, separator in reversed(current):
+            if carried_tokens + tokens > overlap_tokens:
+                # Carry the end of a piece too big to carry whole
+                tail = _tail(text, overlap_tokens - carried_tokens)
+                if tail:
+                    tail_tokens = count_tokens(tail)
+                    carried.insert(0, (tail, tail_tokens, page_number, separator))
+                    carried_tokens += tail_tokens
+                break
+            carried.insert(0, (text, tokens, page_number, separator))
+            carried_tokens += tokens
+        return carried, carried_tokens
+
+    for text, tokens, page_number, heading, separator in _pieces(pages, max_tokens, detect_headings):
+        if heading:
+            # A run of heading-like lines, e.g. a short numbered list, stays in
+            # the chunk as text under the first line's section
+            if has_new_text or (current and current_tokens + tokens > max_tokens):
+                yield emit()
+                current, current_tokens = [], 0
+            if not current:
+                section = text
+            current.append((text, tokens, page_number, separator))
+            current_tokens += tokens
+            has_new_text = False
+            continue
+
+        if current_tokens + tokens > max_tokens and has_new_text:
+            yield emit()
+            current, current_tokens = carry_overlap()
+            # Drop overlap that would leave no room for the new piece
+            while current and current_tokens + tokens > max_tokens:
+                current_tokens -= current.pop(0)[1]
+        current.append((text, tokens, page_number, separator))
+        current_tokens += tokens
+        has_new_text = True
+
+    # Whatever is left, even if it is only headings
+    if current:
+        yield emit()
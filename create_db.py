@@ -1,5 +1,11 @@
-from app import db, create_app
+"""Create or upgrade the database schema by applying the migrations.
+
+Equivalent to `flask --app app db upgrade`, which the release phase runs on
+every deploy.
+"""
+from flask_migrate import upgrade
+
+from app import app
 
-app = create_app()
 with app.app_context():
-    db.create_all()
+    upgrade()
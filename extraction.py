@@ -0,0 +1,338 @@
+"""Text extraction for uploaded documents.
+
+Kept out of app.py because process pool workers have to import the module
+that holds their task, and importing app.py connects to Pinecone and the
+database.
+
+extract_pages picks a reader by file extension. PDF pages are extracted on
+a process pool. The other formats are read as a stream and split into
+pseudo-pages: blocks of lines for text, blocks of rows for CSV and
+spreadsheets, and the page breaks Word recorded for DOCX. That way a large
+spreadsheet is never held in memory as a whole workbook.
+"""
+import csv
+import datetime
+import logging
+import multiprocessing
+import os
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+from PyPDF2 import PdfReader
+
+logger = logging.getLogger(__name__)
+
+# Number of extraction processes, a per-page timeout in seconds, and the page
+# count below which pages are extracted inline because the pool isn't worth it
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+PDF_PAGE_TIMEOUT = float(os.getenv('PDF_PAGE_TIMEOUT', '30'))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '8'))
+# Size of the pseudo-pages of text files, and of CSV files and spreadsheets
+TEXT_LINES_PER_PAGE = int(os.getenv('TEXT_LINES_PER_PAGE', '100'))
+TABLE_ROWS_PER_PAGE = int(os.getenv('TABLE_ROWS_PER_PAGE', '50'))
+
+# Extensions extract_pages can read, and those whose lines may be headings;
+# the others are plain text or table rows
+DOCUMENT_EXTENSIONS = ('pdf', 'txt', 'csv', 'xlsx', 'xls', 'docx')
+HEADING_EXTENSIONS = ('pdf', 'docx')
+
+class UnsupportedDocumentError(ValueError):
+    """Raised for a file whose format can't be extracted"""
+
+# Reader cache inside each pool worker, so a document is parsed once per worker
+_worker_reader = {}
+
+def _extract_pdf_page(path, page_index):
+    """Pool task: extract the text of one page"""
+    key = (path, os.path.getmtime(path), os.path.getsize(path))
+    reader = _worker_reader.get(key)
+    if reader is None:
+        _worker_reader.clear()
+        reader = PdfReader(path)
+        _worker_reader[key] = reader
+    return reader.pages[page_index].extract_text() or ''
+
+def extract_pdf_pages(path, workers=None, page_timeout=None):
+    """Extract text from every page of a PDF.
+
+    Pages are spread over a process pool and returned in order as
+    (page_number, text) tuples with 1-based page numbers. Each call gets its
+    own pool, so pages of other documents neither queue behind this one's
+    nor are lost when it is restarted. A page that takes longer than
+    page_timeout seconds is logged and returned as empty text, and the pool
+    is replaced so the stuck worker can't hold up the rest.
+    """
+    workers = workers or PDF_EXTRACT_WORKERS
+    page_timeout = page_timeout or PDF_PAGE_TIMEOUT
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        return [(i + 1, page.extract_text() or '') for i, page in enumerate(reader.pages)]
+
+    workers = min(workers, page_count)
+    # spawn, not fork: the web worker runs gRPC and ingestion threads
+    context = multiprocessing.get_context('spawn')
+    texts = {}
+    remaining = list(range(page_count))
+    while remaining:
+        pool = context.Pool(processes=workers)
+        try:
+            pending = [(i, pool.apply_async(_extract_pdf_page, (path, i))) for i in remaining]
+            remaining = []
+            for position, (page_index, result) in enumerate(pending):
+                try:
+                    texts[page_index] = result.get(timeout=page_timeout)
+                except multiprocessing.TimeoutError:
+                    logger.warning(f"Timed out extracting page {page_index + 1} of {path} after {page_timeout}s")
+                    texts[page_index] = ''
+                    # Keep what already finished, resubmit the rest to a fresh pool
+                    for later_index, later_result in pending[position + 1:]:
+                        if later_result.ready() and later_result.successful():
+                            texts[later_index] = later_result.get()
+                        else:
+                            remaining.append(later_index)
+                    break
+        finally:
+            pool.terminate()
+
+    logger.info(f"Extracted {page_count} pages from {path} with {workers} workers")
+    return [(i + 1, texts[i]) for i in range(page_count)]
+
+def document_extension(filename):
+    return os.path.splitext(filename)[1].lstrip('.').lower()
+
+def extract_pages(path, filename=None):
+    """Extract (page_number, text) tuples from a document, picking the reader by extension.
+
+    The extension is taken from filename if given, since spooled uploads and
+    downloads may not keep it in their path. PDFs come back as a list; the
+    other formats as a generator that reads the file as it is consumed.
+    """
+    extension = document_extension(filename or path)
+    if extension == 'pdf':
+        return extract_pdf_pages(path)
+    if extension == 'txt':
+        return extract_text_pages(path)
+    if extension == 'csv':
+        return extract_csv_pages(path)
+    if extension == 'xlsx':
+        return extract_xlsx_pages(path)
+    if extension == 'xls':
+        return extract_xls_pages(path)
+    if extension == 'docx':
+        return extract_docx_pages(path)
+    if extension == 'doc':
+        raise UnsupportedDocumentError('Legacy Word .doc files are not supported, save the document as .docx or PDF')
+    raise UnsupportedDocumentError(f'Unsupported document type: {extension or "no extension"}')
+
+def extract_text_pages(path, lines_per_page=None):
+    """Yield a plain text file in pages of about lines_per_page lines.
+
+    A page ends at the first blank line after lines_per_page lines, so
+    paragraphs aren't cut in half, or at twice that many lines when there
+    is none.
+    """
+    lines_per_page = lines_per_page or TEXT_LINES_PER_PAGE
+    page_number = 1
+    lines = []
+    with open(path, encoding='utf-8-sig', errors='replace', newline=None) as text_file:
+        for line in text_file:
+            line = line.rstrip('\n')
+            lines.append(line)
+            if len(lines) >= lines_per_page and (not line.strip() or len(lines) >= 2 * lines_per_page):
+                yield page_number, '\n'.join(lines)
+                page_number += 1
+                lines = []
+    if any(line.strip() for line in lines):
+        yield page_number, '\n'.join(lines)
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if value.time() == datetime.time() else value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value).strip()
+
+def _table_pages(rows, first_page, title=None, rows_per_page=None):
+    """Yield pages of rows_per_page rows from an iterable of row value sequences.
+
+    The first non-empty row is taken as the header, and every row is written
+    as "header: value" pairs in a paragraph of its own, so a chunk of rows
+    still says what its numbers are. title, e.g. the sheet name, starts
+    every page.
+    """
+    rows_per_page = rows_per_page or TABLE_ROWS_PER_PAGE
+    page_number = first_page
+    header = None
+    paragraphs = []
+
+    def page_text():
+        return '\n\n'.join(([title] if title else []) + paragraphs)
+
+    for row in rows:
+        values = [_cell_text(value) for value in row]
+        if not any(values):
+            continue
+        if header is None:
+            header = [value or f'Column {i + 1}' for i, value in enumerate(values)]
+            continue
+        paragraphs.append('; '.join(
+            f'{header[i] if i < len(header) else f"Column {i + 1}"}: {value}'
+            for i, value in enumerate(values) if value
+        ))
+        if len(paragraphs) >= rows_per_page:
+            yield page_number, page_text()
+            page_number += 1
+            paragraphs = []
+    if paragraphs:
+        yield page_number, page_text()
+    elif header is not None and page_number == first_page:
+        # A table with nothing but a header row
+        yield page_number, '\n\n'.join(([title] if title else []) + ['; '.join(header)])
+
+def extract_csv_pages(path, rows_per_page=None):
+    """Yield a CSV file in pages of rows, detecting the delimiter from its start"""
+    with open(path, encoding='utf-8-sig', errors='replace', newline='') as csv_file:
+        sample = csv_file.read(64 * 1024)
+        csv_file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        yield from _table_pages(csv.reader(csv_file, dialect), 1, rows_per_page=rows_per_page)
+
+def extract_xlsx_pages(path, rows_per_page=None):
+    """Yield every worksheet of an .xlsx workbook in pages of rows.
+
+    The workbook is opened read-only, which streams each sheet's XML instead
+    of building the whole workbook, so memory stays flat however many rows
+    it has. Formulas give their last saved values.
+    """
+    try:
+        import openpyxl
+    except ImportError:
+        raise UnsupportedDocumentError('Reading .xlsx files requires the openpyxl package')
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        page_number = 1
+        for sheet in workbook.worksheets:
+            for page_number, text in _table_pages(
+                sheet.iter_rows(values_only=True), page_number, f'Sheet: {sheet.title}', rows_per_page
+            ):
+                yield page_number, text
+            page_number += 1
+    finally:
+        workbook.close()
+
+def extract_xls_pages(path, rows_per_page=None):
+    """Yield every sheet of a legacy .xls workbook in pages of rows, loading one sheet at a time"""
+    try:
+        import xlrd
+    except ImportError:
+        raise UnsupportedDocumentError('Reading .xls files requires the xlrd package')
+
+    workbook = xlrd.open_workbook(path, on_demand=True)
+    try:
+        page_number = 1
+        for sheet_index in range(workbook.nsheets):
+            sheet = workbook.sheet_by_index(sheet_index)
+
+            def rows():
+                for row_index in range(sheet.nrows):
+                    yield [
+                        xlrd.xldate_as_datetime(cell.value, workbook.datemode)
+                        if cell.ctype == xlrd.XL_CELL_DATE else cell.value
+                        for cell in sheet.row(row_index)
+                    ]
+
+            for page_number, text in _table_pages(rows(), page_number, f'Sheet: {sheet.name}', rows_per_page):
+                yield page_number, text
+            page_number += 1
+            workbook.unload_sheet(sheet_index)
+    finally:
+        workbook.release_resources()
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def extract_docx_pages(path):
+    """Yield the paragraphs and tables of a .docx document page by page.
+
+    word/document.xml is parsed incrementally and every finished paragraph
+    or table is dropped from the tree. Pages follow the page breaks Word
+    recorded when the document was last saved; a document without them
+    comes back as one page. Table rows become one paragraph each with their
+    cells separated by " | ".
+    """
+    with zipfile.ZipFile(path) as archive:
+        try:
+            document = archive.open('word/document.xml')
+        except KeyError:
+            raise UnsupportedDocumentError(f'{os.path.basename(path)} is not a Word document')
+        with document:
+            page_number = 1
+            paragraphs = []
+            parts = []  # text of the current paragraph
+            cell_parts = []  # paragraphs of the current table cell, nested tables included
+            cells = []  # cells of the current table row
+            table_depth = 0
+            body = None
+            # Word may mark one break twice, as a hard break and as where it rendered the page
+            text_since_break = False
+
+            for event, element in iterparse(document, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == _W + 'body':
+                        body = element
+                    elif tag == _W + 'tbl':
+                        table_depth += 1
+                    continue
+
+                if tag == _W + 't':
+                    parts.append(element.text or '')
+                    text_since_break = text_since_break or bool(element.text)
+                elif tag == _W + 'tab':
+                    parts.append('\t')
+                elif tag in (_W + 'br', _W + 'cr') and element.get(_W + 'type') != 'page':
+                    parts.append('\n')
+                elif tag in (_W + 'br', _W + 'lastRenderedPageBreak'):
+                    if not table_depth and text_since_break:
+                        # Text before the break belongs to the previous page
+                        text = ''.join(parts).strip()
+                        if text:
+                            paragraphs.append(text)
+                        parts = []
+                        if paragraphs:
+                            yield page_number, '\n\n'.join(paragraphs)
+                            paragraphs = []
+                        page_number += 1
+                        text_since_break = False
+                elif tag == _W + 'p':
+                    text = ''.join(parts).strip()
+                    parts = []
+                    if table_depth and text:
+                        cell_parts.append(text)
+                    elif text:
+                        paragraphs.append(text)
+                elif tag == _W + 'tc' and table_depth == 1:
+                    cells.append(' '.join(cell_parts))
+                    cell_parts = []
+                elif tag == _W + 'tr' and table_depth == 1:
+                    row = ' | '.join(cell for cell in cells if cell)
+                    if row:
+                        paragraphs.append(row)
+                    cells = []
+                elif tag == _W + 'tbl':
+                    table_depth -= 1
+
+                if body is not None and not table_depth and tag in (_W + 'p', _W + 'tbl'):
+                    body.clear()
+
+            if paragraphs:
+                yield page_number, '\n\n'.join(paragraphs)
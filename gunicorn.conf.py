@@ -0,0 +1,18 @@
+"""Gunicorn settings, loaded from the working directory by default.
+
+Requests spend nearly all their time waiting on OpenAI, the vector store
+and S3, so each worker runs a pool of threads (the gthread worker) and a
+thread blocked on I/O leaves the others free. The per-upstream limits in
+app.py keep that many threads from overrunning the connection pools.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Heroku sets WEB_CONCURRENCY from the dyno size
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+# Streamed chat answers keep a thread busy for the whole generation
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
@@ -0,0 +1,145 @@
+"""Latency histograms and counters exposed in the Prometheus text format.
+
+Each gunicorn worker keeps its own histograms, so /metrics reports the
+worker that served the scrape. Stage timings recorded while a request is
+being handled are also collected on flask.g for the Server-Timing header.
+"""
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from flask import g, has_request_context
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    def __init__(self, name, documentation, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = {labels: list(series) for labels, series in self.series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values))
+            separator = ',' if labels else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{separator}le="+Inf"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-2]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-1]:.6f}')
+        return '\n'.join(lines)
+
+class Counter:
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}  # label values -> count
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            snapshot = dict(self.values)
+        for label_values, value in sorted(snapshot.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return '\n'.join(lines)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+request_seconds = Histogram(
+    'http_request_duration_seconds',
+    'Time to produce a response, by route (streamed bodies are not included)',
+    ('route', 'method', 'status')
+)
+stage_seconds = Histogram(
+    'stage_duration_seconds',
+    'Time spent in each external call or processing stage',
+    ('stage', 'route')
+)
+singleflight_calls = Counter(
+    'singleflight_calls_total',
+    'Calls through a single-flight group by outcome; every outcome but leader is a computation saved',
+    ('group', 'outcome')
+)
+
+def current_route():
+    if has_request_context():
+        from flask import request
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return 'background'
+
+def record_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage, current_route())
+    if has_request_context():
+        timings = g.setdefault('stage_timings', {})
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage):
+    """Record how long the block takes under the given stage name, failures included"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+class TimedProxy:
+    """Wrap an object so calls to the listed methods are timed as <prefix>_<method>.
+
+    When limit is given, each of those calls is made inside it, and time
+    spent waiting on the limit is not counted in the call's timing.
+    """
+
+    def __init__(self, target, prefix, methods, limit=None):
+        self._target = target
+        self._prefix = prefix
+        self._methods = frozenset(methods)
+        self._limit = limit
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if name not in self._methods:
+            return attribute
+
+        def timed_call(*args, **kwargs):
+            with self._limit or nullcontext(), timed(f'{self._prefix}_{name}'):
+                return attribute(*args, **kwargs)
+        return timed_call
+
+def server_timing_header():
+    """Server-Timing value for the stages recorded during this request"""
+    timings = g.get('stage_timings') or {}
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items())
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in (request_seconds, stage_seconds, singleflight_calls)) + '\n'
+
+def call_timed(function, *args, **kwargs):
+    """Call function and return (result, seconds), for timing work done on another thread"""
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
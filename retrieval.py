@@ -0,0 +1,148 @@
+"""Lexical retrieval, rank fusion and reranking for chat context selection.
+
+The vector index finds chunks that mean roughly the same as a question but
+often misses exact tokens such as clause numbers, product codes and Dutch
+compound terms. BM25Index covers those; reciprocal_rank_fusion merges both
+rankings and rerank picks the final contexts with cheap lexical features.
+"""
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+(?:[.\-/]\w+)*')
+
+STOPWORDS = frozenset('''
+    de het een en van in op te dat die is voor met aan er niet zijn om ook als
+    bij of dan door over tot uit naar maar nog wat wordt worden kan mijn je ik
+    wij we u hoe wanneer welke waar
+    the a an and of in on to that is for with at by or not be are as it this
+    from what how when which where do does my i you we can
+'''.split())
+
+def tokenize(text):
+    """Lowercase word tokens; compound tokens like 3.2.1 or ABC-123 are kept whole and also split"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r'[.\-/]', token) if part)
+    return [token for token in tokens if token not in STOPWORDS]
+
+class RetrievedChunk:
+    def __init__(self, id, text, metadata=None, vector_score=None, lexical_score=None):
+        self.id = id
+        self.text = text
+        self.metadata = metadata or {}
+        self.vector_score = vector_score
+        self.lexical_score = lexical_score
+        self.fused_score = 0.0
+        self.rerank_score = 0.0
+
+    def __repr__(self):
+        return f'<RetrievedChunk {self.id} {self.rerank_score:.3f}>'
+
+class BM25Index:
+    """Okapi BM25 over an in-memory list of chunks.
+
+    Per-term weights are precomputed at build time, so a search is a few
+    numpy scatter-adds over the postings of the query terms.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        # chunks: iterable of (id, text, metadata)
+        self.ids = []
+        self.texts = []
+        self.metadata = []
+        term_counts = []
+        for chunk_id, text, metadata in chunks:
+            self.ids.append(chunk_id)
+            self.texts.append(text)
+            self.metadata.append(metadata or {})
+            term_counts.append(Counter(tokenize(text)))
+
+        count = len(self.ids)
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if count else 0.0
+
+        postings = {}
+        for position, counts in enumerate(term_counts):
+            for term, frequency in counts.items():
+                postings.setdefault(term, []).append((position, frequency))
+
+        self.idf = {}
+        self.postings = {}
+        for term, entries in postings.items():
+            idf = math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            positions = np.fromiter((position for position, _ in entries), dtype=np.int64, count=len(entries))
+            frequencies = np.fromiter((frequency for _, frequency in entries), dtype=np.float32, count=len(entries))
+            norms = k1 * (1 - b + b * lengths[positions] / (average_length or 1.0))
+            self.idf[term] = idf
+            self.postings[term] = (positions, idf * frequencies * (k1 + 1) / (frequencies + norms))
+        # Unseen terms are as rare as a term that occurs once
+        self.max_idf = math.log(1 + (count - 0.5) / 1.5) if count else 1.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, top_k):
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                positions, weights = self.postings[term]
+                scores[positions] += weights
+                matched = True
+        if not matched:
+            return []
+        k = min(top_k, len(self.ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            RetrievedChunk(self.ids[i], self.texts[i], self.metadata[i], lexical_score=float(scores[i]))
+            for i in top if scores[i] > 0
+        ]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge ranked lists of RetrievedChunk by id, scoring each by the sum of 1 / (k + rank)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            existing = fused.get(chunk.id)
+            if existing is None:
+                fused[chunk.id] = existing = chunk
+            else:
+                if chunk.vector_score is not None:
+                    existing.vector_score = chunk.vector_score
+                if chunk.lexical_score is not None:
+                    existing.lexical_score = chunk.lexical_score
+            existing.fused_score += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda chunk: -chunk.fused_score)
+
+def rerank(query, candidates, idf, default_idf, top_k, min_vector_score, min_coverage):
+    """Order candidates by a blend of vector similarity and IDF-weighted query term coverage.
+
+    A candidate is kept only if it is close enough to the question in
+    embedding space or covers enough of the question's informative terms,
+    so unrelated questions still get no context.
+    """
+    query_terms = set(tokenize(query))
+    weights = {term: idf.get(term, default_idf) for term in query_terms}
+    total_weight = sum(weights.values()) or 1.0
+    # Numbers and codes have to match exactly, so finding them counts double
+    exact_terms = {term for term in query_terms if any(c.isdigit() for c in term)}
+    best_fused = max((chunk.fused_score for chunk in candidates), default=0.0) or 1.0
+
+    kept = []
+    for chunk in candidates:
+        chunk_terms = set(tokenize(chunk.text))
+        coverage = sum(weight for term, weight in weights.items() if term in chunk_terms) / total_weight
+        exact = len(exact_terms & chunk_terms) / len(exact_terms) if exact_terms else 0.0
+        vector_score = chunk.vector_score or 0.0
+        if vector_score < min_vector_score and coverage < min_coverage:
+            continue
+        chunk.rerank_score = 0.45 * vector_score + 0.35 * coverage + 0.1 * exact + 0.1 * chunk.fused_score / best_fused
+        kept.append(chunk)
+    kept.sort(key=lambda chunk: -chunk.rerank_score)
+    return kept[:top_k]
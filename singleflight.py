@@ -0,0 +1,207 @@
+"""Coalescing of identical concurrent computations, within and across processes.
+
+The first caller for a key computes the result. Other threads of the same
+process asking for that key meanwhile wait for it and share the result.
+Across gunicorn workers, the computing thread holds an exclusive lock on a
+per-key file, writes the result into that file and only then releases the
+lock, so a worker that found the lock taken waits for it and reads the
+result instead of computing it again. A result stays readable for
+result_ttl seconds, which also covers duplicates that arrive just after.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import record_stage, singleflight_calls
+
+logger = logging.getLogger(__name__)
+
+LEADER = 'leader'
+COALESCED = 'coalesced'  # waited on another thread of this process
+SHARED = 'shared'  # read the result another process wrote
+STALE_FILE_SECONDS = 3600
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+class Flight:
+    """A caller's place in a single-flight call, returned by SingleFlight.join.
+
+    When outcome is LEADER the caller computes the result and must end the
+    flight with finish(result), or abandon() if it can't, so waiting
+    callers stop waiting. Otherwise result already holds the answer.
+    """
+
+    def __init__(self, group, key, outcome, result=None, call=None, file=None):
+        self.group = group
+        self.key = key
+        self.outcome = outcome
+        self.result = result
+        self.call = call
+        self.file = file
+        self.ended = outcome != LEADER
+
+    def finish(self, result):
+        """Hand result to the callers waiting on this flight"""
+        if self.ended:
+            return
+        self.result = result
+        if self.file is not None:
+            self.group._write_result(self.file, self.key, result)
+        self._end(failed=False)
+        singleflight_calls.inc(self.group.name, LEADER)
+
+    def abandon(self):
+        """End the flight without a result; waiting callers compute their own. A no-op once finished"""
+        if not self.ended:
+            self._end(failed=True)
+
+    def _end(self, failed):
+        self.ended = True
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.group._remove_stale_files()
+        if self.call is not None:
+            self.call.result = self.result
+            self.call.failed = failed
+            self.group._forget(self.key)
+            self.call.done.set()
+
+class SingleFlight:
+    def __init__(self, name, directory, result_ttl=15.0, wait_timeout=90.0, poll_interval=0.05):
+        self.name = name
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def do(self, key, function):
+        """Return (result, outcome) for key, calling function only if no other caller is already on it.
+
+        The result must be JSON serializable to be shared with other
+        processes. If the caller being waited on fails or takes longer than
+        wait_timeout, the waiting caller computes the result itself.
+        """
+        flight = self.join(key)
+        if flight.outcome != LEADER:
+            return flight.result, flight.outcome
+        try:
+            result = function()
+        except BaseException:
+            flight.abandon()
+            raise
+        flight.finish(result)
+        return result, LEADER
+
+    def join(self, key):
+        """Return a Flight for key, waiting for the result if another caller is already computing it.
+
+        For callers that can't wrap the computation in a function, such as
+        a response streamed while it is generated.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            started = time.perf_counter()
+            finished = call.done.wait(self.wait_timeout)
+            record_stage(f'{self.name}_coalesced_wait', time.perf_counter() - started)
+            if finished and not call.failed:
+                singleflight_calls.inc(self.name, COALESCED)
+                return Flight(self, key, COALESCED, call.result)
+            logger.info(f"{self.name}: computing {key!r} separately, the first caller failed or timed out")
+            return Flight(self, key, LEADER)
+
+        flight = Flight(self, key, LEADER, call=call)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            flight.file = open(self._path(key), 'a+b')
+            if not self._lock(flight.file):
+                logger.info(f"{self.name}: computing {key!r} separately, another process holds it too long")
+                flight.file.close()
+                flight.file = None
+                return flight
+            flight.file.seek(0)
+            entry = _read_entry(flight.file.read())
+        except BaseException:
+            flight.abandon()
+            raise
+
+        if entry and entry.get('key') == key and time.time() - entry['created'] < self.result_ttl:
+            # Another process computed it; this process's waiters get it too
+            flight.result = entry['result']
+            flight._end(failed=False)
+            flight.outcome = SHARED
+            singleflight_calls.inc(self.name, SHARED)
+        return flight
+
+    def _forget(self, key):
+        with self.lock:
+            self.calls.pop(key, None)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _lock(self, file):
+        """Take the file's exclusive lock, polling so the wait can time out; returns False on timeout"""
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(self.poll_interval)
+        waited = time.perf_counter() - started
+        if waited >= self.poll_interval:
+            record_stage(f'{self.name}_coalesced_wait', waited)
+        return True
+
+    def _write_result(self, file, key, result):
+        try:
+            data = json.dumps({'key': key, 'created': time.time(), 'result': result}).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            logger.warning(f"{self.name}: result for {key!r} can't be shared: {str(e)}")
+            data = b''
+        file.seek(0)
+        file.truncate()
+        file.write(data)
+        file.flush()
+
+    def _remove_stale_files(self):
+        """Now and then delete result files nobody has asked for in a long time"""
+        with self.lock:
+            self.writes += 1
+            if self.writes % 100:
+                return
+        cutoff = time.time() - STALE_FILE_SECONDS
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+def _read_entry(data):
+    if not data:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
@@ -280,6 +280,55 @@ function saveBaloiseSettings(section) {
     });
 }
 
+// Save all five sections of a company in one request
+function saveAllSectionSettings(company) {
+    const quill = company === 'degoudse' ? deGoudseQuill : baloiseQuill;
+    const sections = [];
+    for (let i = 1; i <= 4; i++) {
+        sections.push({
+            section_number: i,
+            title: document.getElementById(`${company}-title-${i}`).value,
+            link: document.getElementById(`${company}-link-${i}`).value,
+            content: ''
+        });
+    }
+    sections.push({
+        section_number: 5,
+        title: '',
+        link: '',
+        content: quill ? quill.root.innerHTML : ''
+    });
+
+    fetch(`/settings/${company}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ sections: sections })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            alert('Settings saved successfully!');
+            const form = document.getElementById(`${company}-form`);
+            form.querySelectorAll('input[type="text"]').forEach(input => {
+                input.disabled = true;
+                input.style.backgroundColor = '#f5f5f5';
+            });
+            form.querySelectorAll('.edit-btn').forEach(button => button.style.display = 'block');
+            form.querySelectorAll('.save-btn').forEach(button => button.style.display = 'none');
+            if (quill) quill.disable();
+            loadAdminContent();
+        } else {
+            alert('Error saving settings: ' + data.message);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Error saving settings');
+    });
+}
+
 function createEmptyState() {
     console.log('Creating empty state');
     const emptyState = `
@@ -297,10 +346,17 @@ function createEmptyState() {
     return emptyState;
 }
 
+// Settings inlined by the page template save a round trip; otherwise fetch them
+function getSectionSettings(company) {
+    if (window.sectionSettings && window.sectionSettings.company === company) {
+        return Promise.resolve(window.sectionSettings.sections);
+    }
+    return fetch(`/get_${company}_settings`).then(response => response.json());
+}
+
 function loadDeGoudseContent() {
     console.log('Loading De Goudse content');
-    fetch('/get_degoudse_settings')
-        .then(response => response.json())
+    getSectionSettings('degoudse')
         .then(data => {
             console.log('Received De Goudse data:', data);
             
@@ -357,8 +413,7 @@ function loadDeGoudseContent() {
 
 function loadBaloiseContent() {
     console.log('Loading Baloise content');
-    fetch('/get_baloise_settings')
-        .then(response => response.json())
+    getSectionSettings('baloise')
         .then(data => {
             console.log('Received Baloise data:', data);
             
@@ -413,22 +468,6 @@ function loadBaloiseContent() {
         .catch(error => console.error('Error:', error));
 }
 
-// Add this to ensure content is loaded when the page loads
-document.addEventListener('DOMContentLoaded', function() {
-    const path = window.location.pathname;
-    if (path === '/degoudse') {
-        loadDeGoudseContent();
-    }
-});
-
-// Make sure we call this function when on the Baloise page
-document.addEventListener('DOMContentLoaded', function() {
-    const path = window.location.pathname;
-    if (path === '/baloise') {
-        loadBaloiseContent();
-    }
-});
-
 function handleIframeError(frameElement) {
     frameElement.onerror = function() {
         console.error('Failed to load iframe content');
@@ -0,0 +1,69 @@
+from chunking import chunk_pages
+
+POLICY_PAGE = (
+    "De verzekering dekt schade aan uw woning:\n"
+    "1. Brand\n"
+    "2. Storm\n"
+    "3. Waterschade\n"
+    "4. Inbraak\n"
+    "\n"
+    "UITSLUITINGEN\n"
+    "ARTIKEL 7\n"
+    "Opzet en grove schuld van de verzekerde zijn niet gedekt."
+)
+
+def chunk_text(pages, **kwargs):
+    return '\n'.join(chunk.text for chunk in chunk_pages(pages, **kwargs))
+
+def test_heading_run_is_kept_as_text():
+    text = chunk_text([(1, POLICY_PAGE)])
+    for line in ('1. Brand', '2. Storm', '3. Waterschade', '4. Inbraak', 'UITSLUITINGEN', 'ARTIKEL 7'):
+        assert line in text
+
+def test_heading_run_takes_the_first_line_as_section():
+    chunks = list(chunk_pages([(1, POLICY_PAGE)]))
+    assert chunks[0].text == 'De verzekering dekt schade aan uw woning:'
+    assert chunks[-1].section == '1. Brand'
+    assert chunks[-1].text.startswith('1. Brand\n2. Storm\n3. Waterschade\n4. Inbraak\nUITSLUITINGEN')
+
+def test_trailing_heading_is_emitted():
+    chunks = list(chunk_pages([(1, 'Some body text.'), (2, 'BIJLAGE A')]))
+    assert chunks[-1].text == 'BIJLAGE A'
+    assert chunks[-1].page_start == 2
+
+def test_document_of_only_headings_is_emitted():
+    chunks = list(chunk_pages([(1, 'INHOUD\n1. Inleiding\n2. Dekking')]))
+    assert len(chunks) == 1
+    assert chunks[0].text == 'INHOUD\n1. Inleiding\n2. Dekking'
+
+def test_long_heading_run_is_split_by_size():
+    lines = '\n'.join(f'{i}. Dekking nummer {i}' for i in range(1, 61))
+    chunks = list(chunk_pages([(1, lines)], max_tokens=50, overlap_tokens=10))
+    assert len(chunks) > 1
+    text = '\n'.join(chunk.text for chunk in chunks)
+    assert all(f'{i}. Dekking nummer {i}' in text for i in range(1, 61))
+
+def test_overlap_carries_the_end_of_a_long_paragraph():
+    paragraphs = [
+        ' '.join(f'Paragraph {p} sentence {s} describes the cover in some detail.' for s in range(4))
+        for p in range(20)
+    ]
+    chunks = list(chunk_pages([(1, '\n\n'.join(paragraphs))], max_tokens=200, overlap_tokens=40))
+    assert len(chunks) > 1
+    for previous, following in zip(chunks, chunks[1:]):
+        last_sentence = previous.text.rsplit('. ', 1)[-1]
+        assert last_sentence in following.text
+
+def test_no_overlap_when_disabled():
+    paragraphs = [f'Paragraph {p} ' + 'word ' * 20 for p in range(10)]
+    chunks = list(chunk_pages([(1, '\n\n'.join(paragraphs))], max_tokens=100, overlap_tokens=0))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.text.startswith('Paragraph')
+
+def test_detect_headings_off_keeps_upper_case_lines_as_text():
+    rows = '\n\n'.join(f'CODE: C{i}; OMSCHRIJVING: INBOEDEL' for i in range(10))
+    chunks = list(chunk_pages([(1, rows)], detect_headings=False))
+    assert all(chunk.section is None for chunk in chunks)
+    text = '\n'.join(chunk.text for chunk in chunks)
+    assert all(f'CODE: C{i}; OMSCHRIJVING: INBOEDEL' in text for i in range(10))
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+import extraction
+from benchmarks.fakes import make_pdf
+from chunking import chunk_pages
+from extraction import (
+    HEADING_EXTENSIONS, UnsupportedDocumentError, document_extension, extract_csv_pages, extract_pages,
+    extract_pdf_pages, extract_xlsx_pages
+)
+
+def chunk_rows(pages, filename):
+    return list(chunk_pages(pages, detect_headings=document_extension(filename) in HEADING_EXTENSIONS))
+
+def test_upper_case_csv_rows_are_all_chunked(tmp_path):
+    path = tmp_path / 'codes.csv'
+    path.write_text('CODE,OMSCHRIJVING\n' + ''.join(f'C{i},INBOEDEL\n' for i in range(100)))
+    text = '\n'.join(chunk.text for chunk in chunk_rows(extract_csv_pages(str(path)), 'codes.csv'))
+    assert all(f'CODE: C{i}; OMSCHRIJVING: INBOEDEL' in text for i in range(100))
+
+def test_upper_case_xlsx_rows_are_all_chunked(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['PRODUCT', 'PREMIE', 'DEKKING'])
+    for i in range(200):
+        sheet.append([f'WOON{i}', 10 + i, 'ALL RISK'])
+    path = tmp_path / 'tarieven.xlsx'
+    workbook.save(path)
+
+    text = '\n'.join(chunk.text for chunk in chunk_rows(extract_xlsx_pages(str(path)), 'tarieven.xlsx'))
+    assert all(f'PRODUCT: WOON{i}; PREMIE: {10 + i}; DEKKING: ALL RISK' in text for i in range(200))
+
+def test_doc_is_rejected():
+    with pytest.raises(UnsupportedDocumentError):
+        extract_pages('policy.doc')
+
+def stuck_first_page(path, page_index):
+    """Pool task that hangs on the first page of stuck.pdf and is slow on the others"""
+    time.sleep(60 if path.endswith('stuck.pdf') and page_index == 0 else 0.3)
+    return extraction._extract_pdf_page(path, page_index)
+
+def test_pdf_page_timeout_leaves_other_extractions_alone(tmp_path, monkeypatch):
+    # Spawned pool workers import this module to run the patched task
+    monkeypatch.setattr(extraction, '_extract_pdf_page', stuck_first_page)
+    pages = [f'Page {i} about home insurance cover' for i in range(12)]
+    for name in ('stuck.pdf', 'fine.pdf'):
+        (tmp_path / name).write_bytes(make_pdf(pages))
+
+    results = {}
+    def extract(name, page_timeout):
+        results[name] = extract_pdf_pages(str(tmp_path / name), workers=2, page_timeout=page_timeout)
+    threads = [
+        threading.Thread(target=extract, args=('stuck.pdf', 1)),
+        threading.Thread(target=extract, args=('fine.pdf', 30)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [text.strip() for _, text in results['fine.pdf']] == pages
+    assert results['stuck.pdf'][0] == (1, '')
+    assert [text.strip() for _, text in results['stuck.pdf'][1:]] == pages[1:]
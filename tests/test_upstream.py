@@ -0,0 +1,21 @@
+import time
+
+from upstream import AdaptiveRateLimiter, TokenBucket
+
+def test_oversized_takes_are_paid_back_before_the_next():
+    bucket = TokenBucket(per_minute=600, burst_seconds=1)
+    started = now = bucket.updated
+    for _ in range(20):
+        now += bucket.wait_time(50, now)
+        bucket.take(50)
+    # Every take after the first one waited for its tokens to refill
+    assert 19 * 50 <= bucket.rate * (now - started) + 1e-6
+
+def test_oversized_acquires_stay_within_tokens_per_minute():
+    limiter = AdaptiveRateLimiter('test', tokens_per_minute=60000, burst_seconds=0.01)
+    started = time.monotonic()
+    for _ in range(6):
+        limiter.acquire(tokens=100)
+        limiter.release()
+    elapsed = time.monotonic() - started
+    assert 5 * 100 <= 1000 * elapsed
@@ -0,0 +1,268 @@
+"""Per-process limits on calls to the external services the app waits on.
+
+Request threads spend most of their time blocked on OpenAI, the vector
+store and S3. The vector store and S3 each get a ConcurrencyLimit, so a
+burst of requests queues briefly inside the worker instead of opening more
+connections than the client pools hold. OpenAI calls go through an
+AdaptiveRateLimiter, which also keeps to the account's request and token
+rate limits and retries throttled calls. Time spent queueing is recorded as
+the <name>_queue stage.
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+
+from metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+class UpstreamBusyError(Exception):
+    """Raised when no slot for an upstream frees up within the queue timeout"""
+
+class ConcurrencyLimit:
+    def __init__(self, name, limit, timeout):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+    def __enter__(self):
+        started = time.perf_counter()
+        acquired = self.semaphore.acquire(timeout=self.timeout)
+        record_stage(f'{self.name}_queue', time.perf_counter() - started)
+        if not acquired:
+            raise UpstreamBusyError(
+                f'{self.name} is at its limit of {self.limit} concurrent calls, '
+                f'no slot freed up within {self.timeout:g}s'
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        self.semaphore.release()
+        return False
+
+    def __repr__(self):
+        return f'<ConcurrencyLimit {self.name} {self.limit}>'
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Statuses worth retrying besides 429: timeouts, conflicts and server errors
+RETRYABLE_STATUSES = frozenset({408, 409, 500, 502, 503, 504})
+MAX_RETRY_AFTER = 60.0
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second and holds at most burst_seconds of refill.
+
+    A take bigger than the bucket leaves it in debt, which later takes wait
+    to be refilled, so the rate holds for oversized requests too. A
+    per_minute of 0 disables the bucket.
+    """
+
+    def __init__(self, per_minute, burst_seconds):
+        self.burst_seconds = burst_seconds
+        self.set_rate(per_minute)
+
+    def set_rate(self, per_minute):
+        self.rate = max(0.0, per_minute) / 60.0
+        self.capacity = max(1.0, self.rate * self.burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now, reserve=0.0):
+        """Seconds until amount can be taken while leaving reserve (a fraction of capacity) behind"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        # A request bigger than the bucket goes through once the bucket is
+        # full, and take() leaves the rest as debt
+        needed = min(amount, self.capacity * (1 - reserve)) + self.capacity * reserve
+        return max(0.0, (needed - self.level) / self.rate)
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= amount
+
+class AdaptiveRateLimiter:
+    """Process-wide request and token budget for one rate-limited API, with retries.
+
+    Each call takes a request and its estimated tokens from the
+    requests-per-minute and tokens-per-minute buckets and a slot under an
+    adaptive concurrency limit. The limit grows by about one per round of
+    successful calls and halves when the API answers 429 (additive
+    increase, multiplicative decrease). A Retry-After on a 429 pauses every
+    caller until it has passed.
+
+    Interactive callers go first: bulk callers wait while any interactive
+    caller is waiting, leave interactive_slots of the concurrency limit and
+    interactive_reserve of each bucket free, so a chat question is never
+    queued behind a document being ingested.
+    """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_concurrency=8,
+                 min_concurrency=1, interactive_slots=1, interactive_reserve=0.1, burst_seconds=10,
+                 max_retries=4, backoff_base=0.5, backoff_max=30.0, queue_timeout=120,
+                 retryable_exceptions=()):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.interactive_slots = interactive_slots
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self.retryable_exceptions = tuple(retryable_exceptions)
+
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.counts = {'calls': 0, 'throttled': 0, 'retries': 0, 'failures': 0}
+
+    def set_rates(self, requests_per_minute=None, tokens_per_minute=None):
+        with self.condition:
+            if requests_per_minute is not None:
+                self.requests.set_rate(requests_per_minute)
+            if tokens_per_minute is not None:
+                self.tokens.set_rate(tokens_per_minute)
+            self.condition.notify_all()
+
+    def _wait_time(self, tokens, priority, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+        if priority == BULK and self.waiting[INTERACTIVE]:
+            return self.queue_timeout  # woken when the interactive caller gets its slot
+        slots = int(self.concurrency)
+        if priority == BULK and slots > self.interactive_slots:
+            slots -= self.interactive_slots
+        if self.in_flight >= slots:
+            return self.queue_timeout  # woken by release()
+        reserve = self.interactive_reserve if priority == BULK else 0.0
+        return max(self.requests.wait_time(1, now, reserve), self.tokens.wait_time(tokens, now, reserve))
+
+    def acquire(self, tokens=1, priority=BULK):
+        """Block until the call may be made; raises UpstreamBusyError after queue_timeout seconds"""
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.queue_timeout
+        with self.condition:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(tokens, priority, now)
+                    if wait <= 0:
+                        break
+                    if now >= deadline:
+                        raise UpstreamBusyError(
+                            f'{self.name} rate limit: no capacity freed up within {self.queue_timeout:g}s'
+                        )
+                    self.condition.wait(min(wait, deadline - now))
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                self.in_flight += 1
+            finally:
+                self.waiting[priority] -= 1
+                # Bulk callers may have been held back for this one
+                self.condition.notify_all()
+        record_stage(f'{self.name}_queue', time.perf_counter() - started)
+
+    def release(self, throttled=False, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.counts['throttled'] += 1
+                # One 429 burst shrinks the limit once, not once per failed call
+                if now - self.last_decrease >= 1.0:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self.last_decrease = now
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self.condition.notify_all()
+
+    def call(self, function, tokens=1, priority=BULK, keep_slot=False):
+        """Call function under the limits, retrying throttling and transient errors with backoff.
+
+        With keep_slot, a successful call keeps its concurrency slot, for a
+        streamed response that is still being read, and the caller must
+        call release() once it is done with it.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority)
+            try:
+                result = function()
+            except Exception as e:
+                status = getattr(e, 'status_code', None)
+                throttled = status == 429
+                retry_after = retry_after_seconds(e) if throttled else None
+                self.release(throttled=throttled, retry_after=retry_after)
+                retryable = throttled or status in RETRYABLE_STATUSES or isinstance(e, self.retryable_exceptions)
+                if not retryable or attempt >= self.max_retries:
+                    with self.condition:
+                        self.counts['failures'] += 1
+                    raise
+                # Full jitter, so callers throttled together don't retry together
+                delay = retry_after if retry_after is not None else random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                )
+                attempt += 1
+                with self.condition:
+                    self.counts['retries'] += 1
+                logger.warning(
+                    f"{self.name} call failed ({status or type(e).__name__}), "
+                    f"retry {attempt} of {self.max_retries} in {delay:.2f}s"
+                )
+                time.sleep(delay)
+                continue
+            if not keep_slot:
+                self.release()
+            with self.condition:
+                self.counts['calls'] += 1
+            return result
+
+    def stats(self):
+        with self.condition:
+            return dict(
+                self.counts,
+                concurrency_limit=round(self.concurrency, 2),
+                in_flight=self.in_flight,
+                waiting=dict(self.waiting),
+                paused_seconds=round(max(0.0, self.paused_until - time.monotonic()), 2),
+                requests_per_minute=self.requests.rate * 60,
+                tokens_per_minute=self.tokens.rate * 60
+            )
+
+def retry_after_seconds(error):
+    """Seconds from the Retry-After (or retry-after-ms) header of a failed HTTP call, if any"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return min(MAX_RETRY_AFTER, max(0.0, float(value) * scale))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            continue
+        return min(MAX_RETRY_AFTER, max(0.0, retry_at.timestamp() - time.time()))
+    return None
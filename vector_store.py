@@ -0,0 +1,307 @@
+"""Vector store backends used for document retrieval.
+
+Both backends expose the calls the app makes on a Pinecone index:
+upsert(vectors=...), query(vector=..., top_k=..., include_metadata=...,
+filter=...), fetch(ids=...), delete(ids=..., delete_all=..., filter=...),
+list_ids(prefix=...) and count().
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class VectorMatch:
+    def __init__(self, id, score, metadata=None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return f'<VectorMatch {self.id} {self.score:.4f}>'
+
+class QueryResult:
+    def __init__(self, matches):
+        self.matches = matches
+
+    def __repr__(self):
+        return f'<QueryResult {self.matches}>'
+
+class FetchedVector:
+    def __init__(self, id, metadata=None):
+        self.id = id
+        self.metadata = metadata or {}
+
+class FetchResult:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def __repr__(self):
+        return f'<FetchResult {len(self.vectors)} vectors>'
+
+def matches_filter(metadata, filter):
+    """Evaluate a Pinecone-style equality filter ({'field': value} or {'field': {'$eq': value}})"""
+    for field, condition in (filter or {}).items():
+        if isinstance(condition, dict):
+            if '$eq' in condition and metadata.get(field) != condition['$eq']:
+                return False
+            if '$in' in condition and metadata.get(field) not in condition['$in']:
+                return False
+        elif metadata.get(field) != condition:
+            return False
+    return True
+
+class PineconeVectorStore:
+    """Thin adapter over a Pinecone index"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors):
+        return self.index.upsert(vectors=vectors)
+
+    def query(self, vector, top_k, include_metadata=True, filter=None):
+        kwargs = {'filter': filter} if filter else {}
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, **kwargs)
+
+    def fetch(self, ids):
+        return self.index.fetch(ids=ids)
+
+    def list_ids(self, prefix):
+        return [vector_id for page in self.index.list(prefix=prefix) for vector_id in page]
+
+    def count(self):
+        return self.index.describe_index_stats().total_vector_count
+
+    def delete(self, ids=None, delete_all=False, filter=None):
+        if delete_all:
+            return self.index.delete(delete_all=True)
+        if filter:
+            return self.index.delete(filter=filter)
+        return self.index.delete(ids=ids)
+
+class LocalVectorStore:
+    """In-process vector index for offline use, load tests and benchmarks.
+
+    Vectors are unit-normalized float32 rows of a memory-mapped .npy matrix,
+    so a query is a single matrix-vector product followed by a top-k
+    partition. Ids and metadata are kept in an append-only JSON lines log
+    that every process replays, and a file lock serializes writers, so
+    several gunicorn workers can share one directory.
+    """
+
+    def __init__(self, path, dimension=1536, initial_capacity=1024):
+        os.makedirs(path, exist_ok=True)
+        self.dimension = dimension
+        self.initial_capacity = initial_capacity
+        self.vectors_path = os.path.join(path, 'vectors.npy')
+        self.log_path = os.path.join(path, 'records.jsonl')
+        self.lock_path = os.path.join(path, '.lock')
+        self.lock = threading.RLock()
+        self.matrix = None
+        self.matrix_stat = None
+        self._reset_records()
+
+    def _reset_records(self):
+        self.ids = []
+        self.metadata = []
+        self.positions = {}
+        self.log_inode = None
+        self.log_offset = 0
+        self.log_lines = 0
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        with self.lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                self._sync()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Pick up writes made by this or any other process since the last call"""
+        if os.path.exists(self.vectors_path):
+            stat = os.stat(self.vectors_path)
+            if (stat.st_ino, stat.st_size) != self.matrix_stat:
+                self.matrix = np.load(self.vectors_path, mmap_mode='r+')
+                self.matrix_stat = (stat.st_ino, stat.st_size)
+        else:
+            self.matrix = None
+            self.matrix_stat = None
+
+        if not os.path.exists(self.log_path):
+            self._reset_records()
+            return
+        stat = os.stat(self.log_path)
+        if stat.st_ino != self.log_inode or stat.st_size < self.log_offset:
+            self._reset_records()
+            self.log_inode = stat.st_ino
+        if stat.st_size == self.log_offset:
+            return
+        with open(self.log_path, 'rb') as log_file:
+            log_file.seek(self.log_offset)
+            for line in log_file:
+                if not line.endswith(b'\n'):
+                    break  # partially written by a writer we raced, read it next time
+                self._apply(json.loads(line))
+                self.log_offset += len(line)
+                self.log_lines += 1
+
+    def _apply(self, record):
+        if record['op'] == 'upsert':
+            position = self.positions.get(record['id'])
+            if position is None:
+                self.positions[record['id']] = len(self.ids)
+                self.ids.append(record['id'])
+                self.metadata.append(record.get('metadata') or {})
+            else:
+                self.metadata[position] = record.get('metadata') or {}
+        elif record['op'] == 'delete':
+            for vector_id in record['ids']:
+                self._remove(vector_id)
+
+    def _remove(self, vector_id):
+        # Swap-remove, mirroring the row moves made by delete()
+        position = self.positions.pop(vector_id, None)
+        if position is None:
+            return
+        last = len(self.ids) - 1
+        if position != last:
+            self.ids[position] = self.ids[last]
+            self.metadata[position] = self.metadata[last]
+            self.positions[self.ids[position]] = position
+        self.ids.pop()
+        self.metadata.pop()
+
+    def _append_log(self, records):
+        with open(self.log_path, 'a', encoding='utf-8') as log_file:
+            log_file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self._sync()
+
+    def _ensure_capacity(self, rows):
+        capacity = self.matrix.shape[0] if self.matrix is not None else 0
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2, self.initial_capacity)
+        temp_path = self.vectors_path + '.tmp'
+        grown = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32, shape=(new_capacity, self.dimension))
+        if capacity:
+            grown[:len(self.ids)] = self.matrix[:len(self.ids)]
+        grown.flush()
+        del grown
+        os.replace(temp_path, self.vectors_path)
+        self._sync()
+
+    def upsert(self, vectors):
+        if not vectors:
+            return
+        ids = [vector['id'] for vector in vectors]
+        values = np.asarray([vector['values'] for vector in vectors], dtype=np.float32)
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values /= np.where(norms == 0, 1.0, norms)
+
+        with self._locked(exclusive=True):
+            new_ids = {vector_id for vector_id in ids if vector_id not in self.positions}
+            self._ensure_capacity(len(self.ids) + len(new_ids))
+            next_row = len(self.ids)
+            rows = {}
+            for vector_id in ids:
+                if vector_id in self.positions:
+                    rows[vector_id] = self.positions[vector_id]
+                elif vector_id not in rows:
+                    rows[vector_id] = next_row
+                    next_row += 1
+            for vector_id, row_values in zip(ids, values):
+                self.matrix[rows[vector_id]] = row_values
+            self.matrix.flush()
+            self._append_log([
+                {'op': 'upsert', 'id': vector['id'], 'metadata': vector.get('metadata') or {}}
+                for vector in vectors
+            ])
+            self._compact_if_needed()
+
+    def query(self, vector, top_k, include_metadata=True, filter=None):
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._locked():
+            count = len(self.ids)
+            if not count:
+                return QueryResult([])
+            scores = self.matrix[:count] @ query
+            if filter:
+                mask = np.fromiter((matches_filter(m, filter) for m in self.metadata), dtype=bool, count=count)
+                scores = np.where(mask, scores, -np.inf)
+            k = min(top_k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return QueryResult([
+                VectorMatch(
+                    self.ids[row],
+                    float(scores[row]),
+                    dict(self.metadata[row]) if include_metadata else None
+                )
+                for row in top if np.isfinite(scores[row])
+            ])
+
+    def fetch(self, ids):
+        with self._locked():
+            return FetchResult({
+                vector_id: FetchedVector(vector_id, dict(self.metadata[self.positions[vector_id]]))
+                for vector_id in ids if vector_id in self.positions
+            })
+
+    def list_ids(self, prefix):
+        with self._locked():
+            return [vector_id for vector_id in self.ids if vector_id.startswith(prefix)]
+
+    def delete(self, ids=None, delete_all=False, filter=None):
+        with self._locked(exclusive=True):
+            if delete_all:
+                open(self.log_path + '.tmp', 'w').close()
+                os.replace(self.log_path + '.tmp', self.log_path)
+                self._sync()
+                return
+            if filter:
+                ids = [vector_id for vector_id, metadata in zip(self.ids, self.metadata)
+                       if matches_filter(metadata, filter)]
+            ids = [vector_id for vector_id in dict.fromkeys(ids or []) if vector_id in self.positions]
+            if not ids:
+                return
+
+            # Move rows exactly as _remove() will when the log is replayed
+            order = list(self.ids)
+            positions = dict(self.positions)
+            for vector_id in ids:
+                position = positions.pop(vector_id)
+                last = len(order) - 1
+                if position != last:
+                    self.matrix[position] = self.matrix[last]
+                    order[position] = order[last]
+                    positions[order[position]] = position
+                order.pop()
+            self.matrix.flush()
+            self._append_log([{'op': 'delete', 'ids': ids}])
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        """Rewrite the log as one upsert per live vector once it is mostly history"""
+        if self.log_lines < 2 * len(self.ids) + 1000:
+            return
+        temp_path = self.log_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as log_file:
+            for vector_id, metadata in zip(self.ids, self.metadata):
+                log_file.write(json.dumps({'op': 'upsert', 'id': vector_id, 'metadata': metadata}) + '\n')
+        os.replace(temp_path, self.log_path)
+        self._sync()
+        logger.info(f"Compacted local vector store log to {len(self.ids)} records")
+
+    def count(self):
+        with self._locked():
+            return len(self.ids)